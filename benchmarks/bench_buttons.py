@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the button dispatcher: idle CPU usage and button-to-countdown
+latency, measured with the fake GPIO backend
+"""
+
+import argparse
+import os
+import sys
+import threading
+from time import monotonic, process_time, sleep
+
+os.environ['PHOTOBOOTH_GPIO'] = 'fake'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hardware import ButtonDispatcher  # noqa: E402
+from hardware.gpio import GPIO  # noqa: E402
+
+TRIGGER_CHANNEL = 23
+
+
+def idle_cpu(duration, legacy):
+    """ Ratio of CPU time over wall time while waiting for a push """
+    stop = threading.Event()
+    dispatcher = ButtonDispatcher()
+    dispatcher.register(TRIGGER_CHANNEL, lambda edge_time: None)
+
+    def busy_poll():
+        """ The former Photobooth.run() loop """
+        while not stop.is_set():
+            if not GPIO.input(TRIGGER_CHANNEL):
+                pass
+
+    thread = threading.Thread(target=busy_poll if legacy else dispatcher.run)
+    start_cpu, start_wall = process_time(), monotonic()
+    thread.start()
+    sleep(duration)
+    cpu, wall = process_time() - start_cpu, monotonic() - start_wall
+    stop.set()
+    dispatcher.stop()
+    thread.join()
+    dispatcher.close()
+    return cpu / wall
+
+
+def latency(pushes, bouncetime):
+    """ Time between the push and the call of the handler, in milliseconds """
+    called = threading.Event()
+    results = []
+
+    def handler(edge_time):
+        """ Stands for Photobooth.take_picture """
+        results.append(monotonic())
+        called.set()
+
+    dispatcher = ButtonDispatcher(bouncetime=bouncetime)
+    dispatcher.register(TRIGGER_CHANNEL, handler)
+    thread = threading.Thread(target=dispatcher.run)
+    thread.start()
+    measures = []
+    for _ in range(pushes):
+        called.clear()
+        pushed = monotonic()
+        GPIO.press(TRIGGER_CHANNEL)
+        called.wait()
+        measures.append((results[-1] - pushed) * 1000)
+        GPIO.release(TRIGGER_CHANNEL)
+        sleep(bouncetime / 1000 * 1.1)
+    dispatcher.stop()
+    thread.join()
+    dispatcher.close()
+    return sorted(measures)
+
+
+def main():
+    """ Main function """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--idle', type=float, default=5,
+                        help='idle measurement duration in seconds')
+    parser.add_argument('--pushes', type=int, default=50,
+                        help='number of simulated pushes')
+    parser.add_argument('--bouncetime', type=int, default=20,
+                        help='debounce time in milliseconds')
+    args = parser.parse_args()
+
+    GPIO.setmode(GPIO.BCM)
+    print('Idle CPU usage (busy polling): %5.1f %%' % (100 * idle_cpu(args.idle, True)))
+    print('Idle CPU usage (dispatcher):   %5.1f %%' % (100 * idle_cpu(args.idle, False)))
+    measures = latency(args.pushes, args.bouncetime)
+    print('Button to countdown latency: median %.3f ms, max %.3f ms' %
+          (measures[len(measures) // 2], measures[-1]))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the resize stage: full decode versus JPEG draft (DCT-scaled)
+decode, wall time and peak RSS for each camera resolution
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from tools.thumbnails import fit_size, open_reduced  # noqa: E402
+
+RESOLUTIONS = {
+    'raspicam-v1': (1024, 768),
+    'raspicam-v2': (3280, 2464),
+    'reflex-24mp': (6000, 4000)
+}
+TARGET = (800, 480)
+
+
+def make_picture(path, size):
+    """ Write a synthetic JPEG picture with some details to compress """
+    image = Image.effect_noise(size, 64).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for i in range(0, size[0], 97):
+        draw.line((i, 0, size[0] - i, size[1]), fill=(i % 256, 128, 255 - i % 256), width=9)
+    image.save(path, quality=95)
+
+
+def peak_rss():
+    """ Peak resident set size of the process, in kilobytes """
+    # ru_maxrss survives the fork/exec of the worker, VmHWM does not
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def worker(method, path, runs):
+    """ Run in a fresh process so that the peak RSS only accounts for one method """
+    timings = []
+    for _ in range(runs):
+        start = perf_counter()
+        if method == 'full':
+            image = Image.open(path)
+            image = image.resize(fit_size(image.size, TARGET), Image.LANCZOS)
+        else:
+            image = open_reduced(path, TARGET)
+            image = image.resize(fit_size(image.size, TARGET), Image.LANCZOS)
+        timings.append(perf_counter() - start)
+    print(json.dumps({'time': min(timings), 'rss': peak_rss()}))
+
+
+def main():
+    """ Main function """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5,
+                        help='number of runs per method (the best one is kept)')
+    parser.add_argument('--worker', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker[0], args.worker[1], args.runs)
+        return 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print('%-12s %-6s %10s %12s' % ('camera', 'decode', 'time (ms)', 'peak RSS (MB)'))
+        for camera, size in RESOLUTIONS.items():
+            path = os.path.join(tmp, camera + '.jpg')
+            make_picture(path, size)
+            for method in ('full', 'draft'):
+                output = subprocess.run(
+                    [sys.executable, __file__, '--runs', str(args.runs),
+                     '--worker', method, path],
+                    check=True, stdout=subprocess.PIPE).stdout
+                result = json.loads(output.decode('utf-8').splitlines()[-1])
+                print('%-12s %-6s %10.1f %12.1f' % (camera, method,
+                                                    result['time'] * 1000,
+                                                    result['rss'] / 1024))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
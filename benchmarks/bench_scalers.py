@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the scaler backends of the slideshow: milliseconds to decode a
+picture and scale it to a 1080p slide, for each backend and source size
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame  # noqa: E402
+from PIL import Image, ImageDraw  # noqa: E402
+
+from tools.scalers import SCALERS, available_scalers, get_scaler  # noqa: E402
+
+SOURCES = {
+    'web': (1600, 1200),
+    'raspicam-v2': (3280, 2464),
+    'reflex-24mp': (6000, 4000)
+}
+SLIDE = (1920, 1080)
+
+
+def make_picture(path, size):
+    """ Write a synthetic JPEG picture with some details to compress """
+    image = Image.effect_noise(size, 64).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for i in range(0, size[0], 97):
+        draw.line((i, 0, size[0] - i, size[1]), fill=(i % 256, 128, 255 - i % 256), width=9)
+    image.save(path, quality=95)
+
+
+def measure(scaler, path, runs):
+    """ Median time of one slide, in milliseconds """
+    timings = []
+    for _ in range(runs):
+        start = perf_counter()
+        scaler(path, SLIDE)
+        timings.append((perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def main():
+    """ Main function """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5, help='runs per measure')
+    args = parser.parse_args()
+
+    pygame.display.init()
+    pygame.display.set_mode(SLIDE)
+    print('smoothscale backend: %s' % pygame.transform.get_smoothscale_backend())
+    missing = [name for name in SCALERS if name not in available_scalers()]
+    if missing:
+        print('not installed: %s' % ', '.join(missing))
+    names = available_scalers()
+    with tempfile.TemporaryDirectory() as directory:
+        print('%-12s' % 'source' + ''.join('%14s' % name for name in names))
+        for source, size in SOURCES.items():
+            path = os.path.join(directory, source + '.jpg')
+            make_picture(path, size)
+            line = '%-12s' % source
+            for name in names:
+                line += '%11.1f ms' % measure(get_scaler(name), path, args.runs)
+            print(line)
+    pygame.quit()
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
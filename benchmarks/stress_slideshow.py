@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stress test of the slideshow: synthetic touch events and new pictures are
+posted from other threads while the slideshow runs, then the state is
+checked against the pictures left on disk
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+from time import monotonic, sleep
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from queue import Queue  # noqa: E402
+
+import pygame  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import remote_ctrl  # noqa: E402
+
+SIZE = (800, 480)
+
+
+def touches(count, seed):
+    """ Random swipes and taps on the remove button """
+    rand = random.Random(seed)
+    trash = remote_ctrl.UI_ASSETS['trash']
+    button = (trash[2][0] + trash[1][0] // 2, trash[2][1] + trash[1][1] // 2)
+    for _ in range(count):
+        if rand.random() < 0.02:
+            yield button, button
+        else:
+            start = (rand.randrange(SIZE[0]), rand.randrange(SIZE[1]))
+            yield start, (rand.randrange(SIZE[0]), start[1])
+
+
+def post_touches(count, seed, interval):
+    """ Touch screen thread """
+    for down, up in touches(count, seed):
+        pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=down, button=1))
+        pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONUP, pos=up, button=1))
+        sleep(interval)
+
+
+def post_pictures(directory, queue, count, interval):
+    """ Network thread: the booth sends new pictures, some of them twice
+    (preview then final rendition) """
+    for i in range(count):
+        name = 'new_%05d.jpg' % i
+        Image.new('RGB', (320, 240), (i % 256, 0, 0)).save(os.path.join(directory, name))
+        queue.put(name)
+        if i % 3 == 0:
+            queue.put(name)
+        sleep(interval)
+
+
+def main():
+    """ Main function """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pictures', type=int, default=300,
+                        help='number of new pictures')
+    parser.add_argument('--touches', type=int, default=5000,
+                        help='number of synthetic touches')
+    parser.add_argument('--slides', type=int, default=20,
+                        help='number of pictures already in the folder')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    remote_ctrl.REVIEW_TIME = 0.2
+    remote_ctrl.MIN_REVIEW_TIME = 0.02
+    directory = tempfile.mkdtemp()
+    try:
+        for i in range(args.slides):
+            Image.new('RGB', (320, 240), (0, i % 256, 0)).save(
+                os.path.join(directory, 'slide_%05d.jpg' % i))
+        queue = Queue()
+        slideshow = remote_ctrl.Slideshow(size=SIZE, time=0.05, path=directory,
+                                          queue=queue, fullscreen=False,
+                                          cache_size=16, recursive=False,
+                                          index_path=os.path.join(directory, '.index.sqlite'))
+        removed = []
+        remove_picture = slideshow.remove_picture
+
+        def checked_remove(picture):
+            """ Only a picture under review can be removed """
+            assert picture == slideshow.remove['picture'], picture
+            removed.append(picture)
+            remove_picture(picture)
+        slideshow.remove_picture = checked_remove
+
+        threads = [
+            threading.Thread(target=post_touches,
+                             args=(args.touches, args.seed, 0.0005)),
+            threading.Thread(target=post_pictures,
+                             args=(directory, queue, args.pictures, 0.005))
+        ]
+
+        def stop():
+            """ Quit once the input threads are done and the queue is empty """
+            for thread in threads:
+                thread.join()
+            while not queue.empty() or slideshow.pending or slideshow.remove['enabled']:
+                sleep(0.05)
+            pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_q))
+
+        start = monotonic()
+        for thread in threads:
+            thread.start()
+        stopper = threading.Thread(target=stop)
+        stopper.daemon = True
+        stopper.start()
+        slideshow.run()
+        elapsed = monotonic() - start
+
+        on_disk = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                         if name.endswith('.jpg'))
+        assert list(slideshow.filelist) == on_disk, 'the playlist differs from the folder'
+        assert all(os.path.basename(path).startswith('new_') for path in removed)
+        assert 0 <= slideshow.next <= len(slideshow.filelist), (slideshow.next, len(slideshow.filelist))
+        print('%d touches and %d pictures in %.1f s: %d removed, %d left, state consistent' %
+              (args.touches, args.pictures, elapsed, len(removed), len(on_disk)))
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 """Exports for the hardware"""
 
+from .buttons import ButtonDispatcher
 from .count_display import CountDisplay
 from .lamp import Lamp
 from .raspicam import RaspiCam
 from .reflexcamera import ReflexCam
 
-__all__ = ['CountDisplay', 'Lamp', 'RaspiCam', 'ReflexCam']
+__all__ = ['ButtonDispatcher', 'CountDisplay', 'Lamp', 'RaspiCam', 'ReflexCam']
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Module that contains the dispatcher of the push buttons"""
+
+import logging
+from queue import Queue
+from time import monotonic
+
+from .gpio import GPIO
+
+if 'PHOTO_LOG' in globals():
+    log = PHOTO_LOG
+else:
+    log = logging.getLogger("BUTTONS_LOG")
+
+
+class ButtonDispatcher:
+    """ Edge-triggered dispatcher for the push buttons
+
+    The GPIO edge interrupts only post the channel and the time of the edge
+    in a queue; run() blocks on this queue and calls the handlers from the
+    calling thread, so waiting for a button costs no CPU at all """
+
+    def __init__(self, bouncetime=200):
+        """ Initialization of the dispatcher, bouncetime is in milliseconds """
+        self.bouncetime = bouncetime
+        self._handlers = {}
+        self._last_edge = {}
+        self._events = Queue()
+
+    def register(self, channel, handler):
+        """ Call handler(edge_time) when the button on channel is pushed """
+        self._handlers[channel] = handler
+        GPIO.setup(channel, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.add_event_detect(channel, GPIO.FALLING, callback=self._on_edge,
+                              bouncetime=self.bouncetime)
+
+    def _on_edge(self, channel):
+        """ Edge callback, called from the GPIO thread """
+        now = monotonic()
+        last = self._last_edge.get(channel)
+        if last is not None and (now - last) * 1000 < self.bouncetime:
+            return
+        # a real push keeps the line low, glitches do not
+        if GPIO.input(channel):
+            return
+        self._last_edge[channel] = now
+        self._events.put((channel, now))
+
+    def discard_pending(self):
+        """ Drop the pushes received so far (e.g. during a picture sequence) """
+        while not self._events.empty():
+            item = self._events.get_nowait()
+            if item is None:
+                # keep the stop request
+                self._events.put(None)
+                return
+
+    def run(self):
+        """ Dispatch the button pushes until stop() is called """
+        while True:
+            item = self._events.get()
+            if item is None:
+                return
+            channel, edge_time = item
+            log.debug('Button pushed on channel %s', channel)
+            self._handlers[channel](edge_time)
+
+    def stop(self):
+        """ Make run() return """
+        self._events.put(None)
+
+    def close(self):
+        """ Remove the edge detections """
+        for channel in self._handlers:
+            GPIO.remove_event_detect(channel)
+        self._handlers = {}
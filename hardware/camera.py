@@ -9,6 +9,9 @@ class Camera(object):
     """ Metaclass for a camera (raspi or reflex) """
     __metaclass__ = ABCMeta
 
+    # whether download() returns a preview, the original coming later
+    deferred = False
+
     @abstractmethod
     def prepare_camera(self):
         """ Abstract method for camera initialization """
@@ -18,3 +21,30 @@ class Camera(object):
     def take_picture(self, path, basename):
         """ Abstract method for taking pictures"""
         pass
+
+    @abstractmethod
+    def trigger(self, path, basename):
+        """ Abstract method for releasing the shutter: returns a handle of
+        the new picture for download(), or None if the capture failed """
+        pass
+
+    @abstractmethod
+    def download(self, shot, context=None):
+        """ Abstract method for fetching a picture taken by trigger():
+        returns the path where the picture should be saved and the JPEG
+        data (a preview for the deferred cameras, which give context back
+        with the original once downloaded; it must be JSON serializable) """
+        pass
+
+    def preview_frame(self):
+        """ Low resolution JPEG frame of the live view, None if there is
+        none """
+        return None
+
+    def capture_to_memory(self, path, basename):
+        """ Take a picture without writing it: returns the path where the
+        picture should be saved and the JPEG data """
+        shot = self.trigger(path, basename)
+        if shot is None:
+            return None, None
+        return self.download(shot)
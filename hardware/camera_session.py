@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""Module that keeps the gphoto2 session of the reflex camera alive"""
+
+import logging
+import threading
+from time import monotonic
+
+if 'PHOTO_LOG' in globals():
+    log = PHOTO_LOG
+else:
+    log = logging.getLogger("REFLEXCAM_LOG")
+
+try:
+    import gphoto2 as gp
+except ImportError:
+    gp = None
+    log.warning("gphoto2 cannot be loaded. Probably not installed")
+
+# gphoto2 errors meaning that the camera is gone (unplugged, USB reset,
+# switched off): the session is opened again
+LOST_ERRORS = ('GP_ERROR_IO', 'GP_ERROR_IO_INIT', 'GP_ERROR_IO_READ',
+               'GP_ERROR_IO_WRITE', 'GP_ERROR_IO_UPDATE',
+               'GP_ERROR_IO_USB_CLEAR_HALT', 'GP_ERROR_IO_USB_FIND',
+               'GP_ERROR_IO_USB_CLAIM', 'GP_ERROR_MODEL_NOT_FOUND',
+               'GP_ERROR_TIMEOUT')
+
+
+class CameraUnavailable(Exception):
+    """ The camera is not connected (a reconnection is under way) """
+
+
+class CameraSession:
+    """ gphoto2 session of a camera, kept open in the background
+
+    Every call to the camera goes through call(), one at a time. When a call
+    fails because the camera is gone, or when the liveness check made every
+    liveness_interval seconds of inactivity fails, a thread opens the
+    session again with an exponential backoff; meanwhile call() raises
+    CameraUnavailable at once instead of blocking the trigger path.
+
+    config is a dictionary {name: value} of settings written once at each
+    connection (e.g. capturetarget, imageformat), the settings the camera
+    does not have are skipped. stats() gives the latency of each operation.
+    """
+
+    def __init__(self, config=None, liveness_interval=5., min_backoff=1.,
+                 max_backoff=10.):
+        if gp is None:
+            raise CameraUnavailable('gphoto2 is not installed')
+        self.config = dict(config or {})
+        self.liveness_interval = liveness_interval
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.context = gp.gp_context_new()
+        self.camera = None
+        self.reconnects = 0
+        self._lost_codes = set(getattr(gp, name) for name in LOST_ERRORS
+                               if hasattr(gp, name))
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._connected = False
+        self._stopping = False
+        self._last_activity = monotonic()
+        self._latency = {}
+        self._connect()
+        self._thread = threading.Thread(target=self._monitor)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def connected(self):
+        """ Whether the camera is connected """
+        return self._connected
+
+    def idle_time(self):
+        """ Seconds since the end of the last call made for a picture """
+        if self._lock.locked():
+            return 0.
+        return monotonic() - self._last_activity
+
+    def _connect(self):
+        """ Open the session and write the configuration, return whether it
+        worked """
+        with self._lock:
+            self._release()
+            start = monotonic()
+            try:
+                camera = gp.check_result(gp.gp_camera_new())
+                gp.check_result(gp.gp_camera_init(camera, self.context))
+            except gp.GPhoto2Error as err:
+                log.warning('Cannot connect to the camera: %s', err)
+                return False
+            self.camera = camera
+            self._apply_config()
+            self._connected = True
+            self._record('connect', monotonic() - start)
+        log.info('Camera connected in %.1f ms', (monotonic() - start) * 1000)
+        return True
+
+    def _release(self):
+        """ Close the current session, if any (the lock is held) """
+        self._connected = False
+        if self.camera is not None:
+            try:
+                gp.gp_camera_exit(self.camera, self.context)
+            except gp.GPhoto2Error:
+                pass
+            self.camera = None
+
+    def _apply_config(self):
+        """ Write the configuration settings (the lock is held) """
+        if not self.config:
+            return
+        try:
+            config = gp.check_result(gp.gp_camera_get_config(self.camera, self.context))
+        except gp.GPhoto2Error as err:
+            log.warning('Cannot read the camera configuration: %s', err)
+            return
+        changed = False
+        for name, value in self.config.items():
+            try:
+                widget = gp.check_result(gp.gp_widget_get_child_by_name(config, name))
+            except gp.GPhoto2Error:
+                log.info('The camera has no %s setting', name)
+                continue
+            if gp.check_result(gp.gp_widget_get_value(widget)) == value:
+                continue
+            try:
+                gp.check_result(gp.gp_widget_set_value(widget, value))
+                changed = True
+            except gp.GPhoto2Error as err:
+                log.warning('Cannot set %s to %s: %s', name, value, err)
+        if changed:
+            try:
+                gp.check_result(gp.gp_camera_set_config(self.camera, config, self.context))
+            except gp.GPhoto2Error as err:
+                log.warning('Cannot write the camera configuration: %s', err)
+
+    def call(self, operation, function, *args, activity=True):
+        """ Run function(camera, *args, context) and record its latency under
+        the name operation; raise CameraUnavailable if the camera is not
+        connected, GPhoto2Error if the call failed. Background calls
+        (activity False) do not reset the idle time """
+        if not self._connected:
+            raise CameraUnavailable('The camera is reconnecting')
+        with self._lock:
+            if not self._connected:
+                raise CameraUnavailable('The camera is reconnecting')
+            start = monotonic()
+            end = start
+            try:
+                result = gp.check_result(function(self.camera, *args, self.context))
+            except gp.GPhoto2Error as err:
+                if err.code in self._lost_codes:
+                    log.error('Camera lost during %s: %s', operation, err)
+                    self._connected = False
+                    with self._wakeup:
+                        self._wakeup.notify()
+                raise
+            finally:
+                end = monotonic()
+                if activity:
+                    self._last_activity = end
+            self._record(operation, end - start)
+            return result
+
+    def set_setting(self, name, value):
+        """ Write one setting right away (e.g. autofocusdrive), return whether
+        the camera has it """
+        def write(camera, context):
+            """ Read, change and write back the configuration """
+            config = gp.check_result(gp.gp_camera_get_config(camera, context))
+            widget = gp.check_result(gp.gp_widget_get_child_by_name(config, name))
+            gp.check_result(gp.gp_widget_set_value(widget, value))
+            return gp.gp_camera_set_config(camera, config, context)
+        try:
+            self.call(name, write)
+        except gp.GPhoto2Error as err:
+            log.debug('Cannot set %s: %s', name, err)
+            return False
+        return True
+
+    def _record(self, operation, elapsed):
+        """ Add a latency measure """
+        count, total, maximum = self._latency.get(operation, (0, 0., 0.))
+        self._latency[operation] = (count + 1, total + elapsed, max(maximum, elapsed))
+
+    def _monitor(self):
+        """ Liveness and reconnection thread """
+        backoff = self.min_backoff
+        while True:
+            with self._wakeup:
+                if not self._stopping:
+                    self._wakeup.wait(self.liveness_interval if self._connected else backoff)
+                if self._stopping:
+                    return
+            if not self._connected:
+                if self._connect():
+                    self.reconnects += 1
+                    backoff = self.min_backoff
+                else:
+                    backoff = min(backoff * 2, self.max_backoff)
+                continue
+            # only when the camera has been idle for a while, and never
+            # delaying a capture
+            if self.idle_time() < self.liveness_interval:
+                continue
+            if not self._lock.acquire(blocking=False):
+                continue
+            self._lock.release()
+            try:
+                self.call('liveness', gp.gp_camera_get_summary, activity=False)
+            except (gp.GPhoto2Error, CameraUnavailable):
+                # lost errors already woke us up
+                pass
+
+    def stats(self):
+        """ Latency of each operation (in milliseconds) and connection state """
+        stats = {
+            'connected': self._connected,
+            'reconnects': self.reconnects
+        }
+        for operation, (count, total, maximum) in self._latency.items():
+            stats[operation] = {
+                'count': count,
+                'mean_ms': total * 1000 / count,
+                'max_ms': maximum * 1000
+            }
+        return stats
+
+    def close(self):
+        """ Stop the monitoring thread and close the session """
+        with self._wakeup:
+            self._stopping = True
+            self._wakeup.notify()
+        self._thread.join()
+        with self._lock:
+            self._release()
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 """Display module for the photobooth"""
 
-import RPi.GPIO as GPIO
+from .gpio import GPIO
 
 
 class CountDisplay:
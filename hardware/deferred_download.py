@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Module that downloads the full pictures from the camera card when idle"""
+
+import json
+import logging
+import threading
+from time import monotonic
+
+if 'PHOTO_LOG' in globals():
+    log = PHOTO_LOG
+else:
+    log = logging.getLogger("REFLEXCAM_LOG")
+
+try:
+    import gphoto2 as gp
+except ImportError:
+    gp = None
+
+from tools.files import atomic_write
+
+from .camera_session import CameraUnavailable
+
+
+class DeferredDownloads:
+    """ Originals left on the camera card, downloaded in the background
+
+    add() records a picture in a JSON manifest (so that the pictures of a
+    previous run are downloaded too), a thread downloads them one at a time
+    once the camera has been idle for idle_delay seconds and calls
+    on_original(target, data, context) for each one before removing it from
+    the manifest; a picture stays in the manifest if on_original() fails.
+    """
+
+    def __init__(self, session, manifest_path, on_original, idle_delay=10.):
+        self.session = session
+        self.manifest_path = manifest_path
+        self.on_original = on_original
+        self.idle_delay = idle_delay
+        self._entries = self._load()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self.count = 0
+        self.download_time = 0.
+        if self._entries:
+            log.info('%d pictures of a previous run are still on the camera',
+                     len(self._entries))
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _load(self):
+        """ Entries of the manifest, empty if there is none """
+        try:
+            with open(self.manifest_path) as manifest:
+                return json.load(manifest)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as err:
+            log.error('Cannot read the manifest %s: %s', self.manifest_path, err)
+            return []
+
+    def _save(self):
+        """ Write the manifest (the condition is held) """
+        try:
+            atomic_write(self.manifest_path, json.dumps(self._entries, indent=1))
+        except OSError as err:
+            log.error('Cannot write the manifest %s: %s', self.manifest_path, err)
+
+    def add(self, folder, name, target, context=None):
+        """ Record a picture of the camera (folder, name) to download to target,
+        context (JSON serializable) is given back with it """
+        with self._condition:
+            self._entries.append({'folder': folder, 'name': name,
+                                  'target': target, 'context': context})
+            self._save()
+            self._condition.notify()
+
+    def pending(self):
+        """ Number of pictures still on the camera only """
+        with self._condition:
+            return len(self._entries)
+
+    def _run(self):
+        """ Download thread """
+        while True:
+            with self._condition:
+                while not self._entries and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                idle = self.session.idle_time()
+                if idle < self.idle_delay or not self.session.connected():
+                    self._condition.wait(max(self.idle_delay - idle, 1.))
+                    continue
+                entry = self._entries[0]
+            start = monotonic()
+            try:
+                camera_file = self.session.call(
+                    'bulk download', gp.gp_camera_file_get, entry['folder'],
+                    entry['name'], gp.GP_FILE_TYPE_NORMAL, activity=False)
+                file_data = gp.check_result(gp.gp_file_get_data_and_size(camera_file))
+            except CameraUnavailable:
+                continue
+            except gp.GPhoto2Error as err:
+                if err.code in (gp.GP_ERROR_FILE_NOT_FOUND, gp.GP_ERROR_DIRECTORY_NOT_FOUND):
+                    log.error('%s/%s is not on the camera anymore',
+                              entry['folder'], entry['name'])
+                    self._done(entry)
+                else:
+                    log.error('Cannot download %s/%s: %s', entry['folder'],
+                              entry['name'], err)
+                    with self._condition:
+                        self._condition.wait(self.idle_delay)
+                continue
+            self.count += 1
+            self.download_time += monotonic() - start
+            try:
+                self.on_original(entry['target'], memoryview(file_data).tobytes(),
+                                 entry.get('context'))
+            except Exception as err:  # the thread must survive a bad picture
+                # kept in the manifest, tried again later or at the next run
+                log.error('Cannot process %s: %s', entry['target'], err)
+                with self._condition:
+                    if not self._stopping:
+                        self._condition.wait(self.idle_delay)
+                continue
+            self._done(entry)
+
+    def _done(self, entry):
+        """ Remove a downloaded picture from the manifest """
+        with self._condition:
+            self._entries.remove(entry)
+            self._save()
+
+    def stats(self):
+        """ Download counters (times in milliseconds) """
+        return {
+            'pending': self.pending(),
+            'count': self.count,
+            'mean_download_ms': self.download_time * 1000 / max(self.count, 1)
+        }
+
+    def close(self):
+        """ Stop the thread, the pictures not downloaded stay in the manifest """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Module that contains a fake GPIO backend, to run the photobooth without a
+Raspberry Pi (tests, benchmarks, development on a laptop)"""
+
+import threading
+from time import monotonic
+
+
+class FakeGPIO:
+    """ Software replacement for the subset of RPi.GPIO used by the photobooth
+
+    Inputs can be driven with press(), release() and set_input(): the edge
+    callbacks registered with add_event_detect() are then called from the
+    calling thread, with the same bouncetime filtering as RPi.GPIO """
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        """ Initialization of the fake GPIO """
+        self.mode = None
+        self._lock = threading.Lock()
+        self._levels = {}
+        self._directions = {}
+        self._detects = {}
+
+    def setmode(self, mode):
+        """ Set the pin numbering mode """
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        """ Warnings are never emitted by the fake backend """
+
+    def setup(self, channel, direction, pull_up_down=None, initial=None):
+        """ Configure a channel as an input or an output """
+        with self._lock:
+            self._directions[channel] = direction
+            if direction == self.IN:
+                self._levels[channel] = self.LOW if pull_up_down == self.PUD_DOWN else self.HIGH
+            else:
+                self._levels[channel] = self.LOW if initial is None else int(initial)
+
+    def output(self, channel, value):
+        """ Set the level of an output channel """
+        with self._lock:
+            self._levels[channel] = int(bool(value))
+
+    def input(self, channel):
+        """ Read the level of a channel """
+        with self._lock:
+            return self._levels.get(channel, self.HIGH)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        """ Register a callback called on the requested edge of a channel """
+        with self._lock:
+            self._detects[channel] = {
+                'edge': edge,
+                'callbacks': [callback] if callback else [],
+                'bouncetime': bouncetime or 0,
+                'last': None
+            }
+
+    def add_event_callback(self, channel, callback):
+        """ Add a callback to an already registered edge detection """
+        with self._lock:
+            self._detects[channel]['callbacks'].append(callback)
+
+    def remove_event_detect(self, channel):
+        """ Remove the edge detection of a channel """
+        with self._lock:
+            self._detects.pop(channel, None)
+
+    def cleanup(self, channel=None):
+        """ Reset the channels """
+        with self._lock:
+            if channel is None:
+                self._levels.clear()
+                self._directions.clear()
+                self._detects.clear()
+            else:
+                self._levels.pop(channel, None)
+                self._directions.pop(channel, None)
+                self._detects.pop(channel, None)
+
+    def set_input(self, channel, value):
+        """ Drive an input channel and fire the matching edge callbacks """
+        value = int(bool(value))
+        with self._lock:
+            previous = self._levels.get(channel, self.HIGH)
+            self._levels[channel] = value
+            detect = self._detects.get(channel)
+            if previous == value or detect is None:
+                return
+            edge = self.RISING if value else self.FALLING
+            if detect['edge'] not in (edge, self.BOTH):
+                return
+            now = monotonic()
+            if detect['last'] is not None and \
+                    (now - detect['last']) * 1000 < detect['bouncetime']:
+                return
+            detect['last'] = now
+            callbacks = list(detect['callbacks'])
+        for callback in callbacks:
+            callback(channel)
+
+    def press(self, channel):
+        """ Simulate a push on a button wired to the ground (falling edge) """
+        self.set_input(channel, self.LOW)
+
+    def release(self, channel):
+        """ Simulate the release of a button wired to the ground """
+        self.set_input(channel, self.HIGH)
@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+"""Module that selects the GPIO backend used by the hardware modules
+
+The real RPi.GPIO module is used, a broken installation fails at import.
+Set the PHOTOBOOTH_GPIO environment variable to "fake" to use the software
+backend instead (tests, development machines)."""
+
+import os
+
+if os.environ.get('PHOTOBOOTH_GPIO', '').lower() == 'fake':
+    from .fake_gpio import FakeGPIO
+    GPIO = FakeGPIO()
+else:
+    import RPi.GPIO as GPIO
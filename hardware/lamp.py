@@ -2,7 +2,7 @@
 
 """Lighting module for the photobooth"""
 
-import RPi.GPIO as GPIO
+from .gpio import GPIO
 
 from math import *
 
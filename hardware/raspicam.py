@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """Module that contains the definition of the rasp pi camera"""
 
+import io
 import logging
 
 if 'PHOTO_LOG' in globals():
@@ -13,7 +14,7 @@ from os.path import join
 from time import sleep
 
 try:
-    from picamera import PiCamera
+    from picamera import PiCamera, PiCameraError
 except ImportError:
     log.warning("PiCamera cannot be loaded. Probably no device detected")
 
@@ -34,6 +35,8 @@ class RaspiCam(Camera):
             self.camera.resolution = (3280, 2464)
         else:
             raise ValueError('Unsupported raspberry pi camera version')
+        # live view frames, captured from the video port into one stream
+        self._preview_stream = io.BytesIO()
         # Camera warm-up
         self.camera.start_preview()
         sleep(2)
@@ -47,6 +50,30 @@ class RaspiCam(Camera):
         self.camera.capture(new_name)
         return new_name
 
+    def preview_frame(self, size=(640, 480)):
+        """ Live view frame, from the video port (no mode switch) """
+        self._preview_stream.seek(0)
+        self._preview_stream.truncate()
+        try:
+            self.camera.capture(self._preview_stream, format='jpeg',
+                                use_video_port=True, resize=size)
+        except PiCameraError as err:
+            log.debug('No live view frame: %s', err)
+            return None
+        return self._preview_stream.getvalue()
+
+    def trigger(self, path, basename):
+        """ Take a picture with the camera into a memory buffer (the sensor
+        is read and encoded at once, nothing is left to download) """
+        new_name = join(path, datetime.now().strftime(basename))
+        stream = io.BytesIO()
+        self.camera.capture(stream, format='jpeg')
+        return new_name, stream.getvalue()
+
+    def download(self, shot, context=None):
+        """ Return the picture taken by trigger() """
+        return shot
+
     def close(self):
         """ Free the camera ressources to avoid GPU memory leaks """
         self.camera.stop_preview()
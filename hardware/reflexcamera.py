@@ -5,53 +5,141 @@ from datetime import datetime
 
 import logging
 import os
-import gphoto2 as gp
-
-from .camera import Camera
+import threading
 
 if 'PHOTO_LOG' in globals():
     log = PHOTO_LOG
 else:
     log = logging.getLogger("REFLEXCAM_LOG")
 
+try:
+    import gphoto2 as gp
+except ImportError:
+    log.warning("gphoto2 cannot be loaded. Probably not installed")
+
+from .camera import Camera
+from .camera_session import CameraSession, CameraUnavailable
+from .deferred_download import DeferredDownloads
+
+# Settings written once at each connection (skipped if the camera does not
+# have them or their value is not one of its choices)
+CAMERA_CONFIG = {
+    'capturetarget': 'Internal RAM',
+    'imageformat': 'Large Fine JPEG'
+}
+# Seconds without camera activity before the originals are downloaded, in
+# the deferred mode
+DEFERRED_IDLE_DELAY = 10
+
+
 class ReflexCam(Camera):
     """ REFLEX Camera """
 
-    def __init__(self):
-        """ Initialization of the camera """
+    def __init__(self, config=None, deferred_manifest=None, on_original=None):
+        """ Initialization of the camera
+
+        With a deferred_manifest path, the pictures are kept on the memory
+        card and download() only returns their preview; the originals are
+        downloaded when the camera is idle and on_original(target, data,
+        context) is called for each of them """
         gp.check_result(gp.use_python_logging())
-        self.context = gp.gp_context_new()
-        self.camera = gp.check_result(gp.gp_camera_new())
-        gp.check_result(gp.gp_camera_init(self.camera, self.context))
+        config = dict(CAMERA_CONFIG if config is None else config)
+        self.deferred = deferred_manifest is not None
+        if self.deferred:
+            # the pictures in the internal RAM are lost if not downloaded
+            config['capturetarget'] = 'Memory card'
+        self.session = CameraSession(config)
+        self.downloads = None
+        if self.deferred:
+            self.downloads = DeferredDownloads(self.session, deferred_manifest,
+                                               on_original, DEFERRED_IDLE_DELAY)
+        self._preparing = None
 
     def prepare_camera(self):
-        """ Prepare the camera for the picture """
+        """ Prepare the camera for the picture: wake it up and focus during
+        the countdown, in the background """
+        if self._preparing is not None and self._preparing.is_alive():
+            return
+        self._preparing = threading.Thread(target=self._prepare)
+        self._preparing.daemon = True
+        self._preparing.start()
+
+    def _prepare(self):
+        """ Pre-focus (Nikon and recent Canon cameras), or at least a
+        round-trip that wakes the camera up """
+        try:
+            if not self.session.set_setting('autofocusdrive', 1):
+                self.session.call('wake', gp.gp_camera_get_summary)
+        except (gp.GPhoto2Error, CameraUnavailable) as err:
+            log.debug('Cannot prepare the camera: %s', err)
 
     def take_picture(self, path, name):
-        """ Take a picture with the camera """
-        
+        """ Take a picture with the camera and write it (not available in
+        the deferred mode, where only a preview is downloaded right away) """
+        if self.deferred:
+            raise RuntimeError('take_picture() cannot write the original in the '
+                               'deferred mode, use trigger() and download()')
         # Ensure directory exists or create it
         if (not os.path.exists(path)) or (not os.path.isdir(path)):
             log.debug("Creating the directory : " + path)
             os.makedirs(path)
-        
-        # TODO To review...
+        target, data = self.capture_to_memory(path, name)
+        if data is None:
+            return None
+        with open(target, 'wb') as picture:
+            picture.write(data)
+        return target
 
-        print('Capturing image')
+    def trigger(self, path, name):
+        """ Release the shutter, the picture stays in the camera """
         try:
-            file_path = gp.check_result(gp.gp_camera_capture(
-                                        self.camera, gp.GP_CAPTURE_IMAGE, self.context))
-        except Exception as err:
-            print('Exception %s', err)
-            return
-        print('After the exception')
-        camera_file = gp.check_result(gp.gp_camera_file_get(
-            self.camera, file_path.folder, file_path.name,
-            gp.GP_FILE_TYPE_NORMAL, self.context))  # TODO define context ??
-        target = os.path.join(path, name)
-        gp.check_result(gp.gp_file_save(camera_file, target))
-        return target
+            file_path = self.session.call('capture', gp.gp_camera_capture,
+                                          gp.GP_CAPTURE_IMAGE)
+        except (gp.GPhoto2Error, CameraUnavailable) as err:
+            log.error('Capture failed: %s', err)
+            return None
+        return os.path.join(path, name), file_path
+
+    def download(self, shot, context=None):
+        """ Download a picture taken by trigger() into memory (only its
+        preview in the deferred mode, the original is then downloaded later
+        and handed over with context) """
+        target, file_path = shot
+        file_type = gp.GP_FILE_TYPE_NORMAL
+        if self.deferred:
+            self.downloads.add(file_path.folder, file_path.name, target, context)
+            file_type = gp.GP_FILE_TYPE_PREVIEW
+        try:
+            camera_file = self.session.call('download', gp.gp_camera_file_get,
+                                            file_path.folder, file_path.name,
+                                            file_type)
+            file_data = gp.check_result(gp.gp_file_get_data_and_size(camera_file))
+        except (gp.GPhoto2Error, CameraUnavailable) as err:
+            log.error('Download of %s failed: %s', file_path.name, err)
+            return None, None
+        return target, memoryview(file_data).tobytes()
+
+    def preview_frame(self):
+        """ Live view frame (the camera lowers its mirror again at the next
+        capture) """
+        try:
+            camera_file = self.session.call('preview', gp.gp_camera_capture_preview)
+            file_data = gp.check_result(gp.gp_file_get_data_and_size(camera_file))
+        except (gp.GPhoto2Error, CameraUnavailable) as err:
+            log.debug('No live view frame: %s', err)
+            return None
+        return memoryview(file_data)
+
+    def stats(self):
+        """ Latency of the camera operations """
+        stats = self.session.stats()
+        if self.downloads is not None:
+            stats['deferred'] = self.downloads.stats()
+        return stats
 
     def close(self):
         """ Free the camera ressources to avoid GPU memory leaks """
-        gp.check_result(gp.gp_camera_exit(self.camera, self.context))
+        log.debug('Camera statistics: %s', self.stats())
+        if self.downloads is not None:
+            self.downloads.close()
+        self.session.close()
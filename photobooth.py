@@ -3,18 +3,28 @@
 """Picture taking module"""
 
 import argparse
-from multiprocessing import Process, Queue
-from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process, Value
+import io
 import logging
-import socket
 import os
 import sys
-from datetime import datetime, timedelta
-from time import sleep
+from datetime import datetime
+from time import monotonic, sleep
+
+from PIL import Image
 
-import RPi.GPIO as GPIO
-from hardware import CountDisplay, Lamp
+from hardware import ButtonDispatcher, CountDisplay, Lamp
+from hardware.gpio import GPIO
+from tools.capture import CaptureScheduler
+from tools.files import atomic_write
+from tools.jpeg import extract_embedded_preview
+from tools.liveview import LiveView
 from tools.photo_log import PHOTO_LOG as log
+from tools.pipeline import PictureQueue
+from tools.strip import LAYOUTS, StripComposer
+from tools.tcp_client import PhotoClient
+from tools.thumbnails import PRESETS, ThumbnailEngine, enlarge
 
 ##################
 ### Parameters ###
@@ -26,6 +36,8 @@ GPIO_TRIGGER_CHANNEL = 23
 GPIO_TRIGGER_LED_CHANNEL = 25
 GPIO_SHUTDOWN_CHANNEL = 24
 GPIO_SHUTDOWN_LED_CHANNEL = 12
+GPIO_BOUNCETIME = 200  # in milliseconds
+STALE_PUSH = 2  # pushes handled later than this (in seconds) are dropped
 GPIO_7SEGMENTS_DISPLAY = {
     "A": 2,
     "B": 3,
@@ -48,7 +60,23 @@ elif TYPE_CAMERA == 2:
 # Pictures properties
 PICTURE_FOLDER = datetime.now().strftime("%Y-%m-%d_Photomaton")
 PICTURE_BASENAME = "%H-%M-%S_Photomaton.jpeg"
-PICTURE_SIZE = 0  # TODO: fill in the value
+PICTURE_SIZE = (800, 480)  # maximum size of the pictures sent to the remote
+# previews smaller than this fraction of PICTURE_SIZE are not shown as they are
+MIN_PREVIEW_SCALE = 0.5
+PICTURE_GRID_SIZE = (320, 240)  # maximum size of the grid thumbnails
+PICTURE_WEB_SIZE = (1600, 1200)  # maximum size of the pictures to share
+THUMBNAIL_PRESET = "balanced"  # see tools.thumbnails.PRESETS
+# back-pressure: a new sequence starts only if at most MAX_PENDING_DOWNLOADS
+# pictures are still downloading and MAX_QUEUE_DEPTH are queued or being
+# compressed
+MAX_PENDING_DOWNLOADS = 1
+MAX_QUEUE_DEPTH = 4
+# Burst mode: pictures per push, countdown between them and composite
+COUNTDOWN = 5  # seconds before the first picture
+BURST_COUNTDOWN = 3  # seconds before the next pictures of a burst
+STRIP_LAYOUT = "strip"  # see tools.strip.LAYOUTS
+STRIP_TILE_SIZE = (1200, 800)  # size of each picture in the composite
+LIVE_VIEW_FPS = 15  # maximum frame rate of the live view sent to the remote
 
 # Network parameters
 HOST, PORT = "192.168.12.11", 5817
@@ -67,13 +95,34 @@ class Photobooth:
 
     def __init__(self, picture_path, picture_compressed_path, picture_basename, picture_size,
                  trigger_channel, trigger_led_channel, seven_segments_channels,
-                 shutdown_channel, shutdown_led_channel, lamp_channel):
-        """ Initialization """
+                 shutdown_channel, shutdown_led_channel, lamp_channel,
+                 extra_renditions=(), thumbnail_preset=THUMBNAIL_PRESET,
+                 transfer=False, burst=1, layout=STRIP_LAYOUT, deferred=False,
+                 live_view=False):
+        """ Initialization
+
+        extra_renditions is a list of (name, path, maximum size) of the
+        renditions created besides the one sent to the remote; with transfer,
+        the screen renditions are sent to the remote instead of their names;
+        with a burst of more than one picture, the pictures of a push are
+        composed into one with the given layout, which is the one sent;
+        deferred (reflex only) keeps the pictures on the camera card and
+        downloads them when idle, their preview is shown meanwhile;
+        live_view streams the camera to the remote during the countdowns """
         # Initialize the parameters
         self.picture_path = os.path.abspath(os.path.join(picture_path,PICTURE_FOLDER))
         self.picture_compressed_path = os.path.abspath(os.path.join(picture_compressed_path,PICTURE_FOLDER))
         self.picture_basename = picture_basename
         self.picture_size = picture_size
+        self.renditions = [("screen", self.picture_compressed_path, picture_size)]
+        for name, path, size in extra_renditions:
+            self.renditions.append(
+                (name, os.path.abspath(os.path.join(path, PICTURE_FOLDER)), size))
+        self.thumbnail_preset = thumbnail_preset
+        self.transfer = transfer
+        self.burst = burst
+        self.live_view = live_view
+        self.layout = layout
         self.trigger_channel = trigger_channel
         self.shutdown_channel = shutdown_channel
         self.trigger_led_channel = trigger_led_channel
@@ -83,7 +132,15 @@ class Photobooth:
         if TYPE_CAMERA == 1:
             self.camera = RaspiCam(version=VERSION_CAMERA)
         elif TYPE_CAMERA == 2:
-            self.camera = ReflexCam()
+            if deferred:
+                # at the root of the pictures: the pictures left on the card
+                # on another day are downloaded too
+                self.camera = ReflexCam(
+                    deferred_manifest=os.path.join(os.path.abspath(picture_path),
+                                                   '.pending_downloads.json'),
+                    on_original=self.original_downloaded)
+            else:
+                self.camera = ReflexCam()
         self.count_display = CountDisplay(seven_segments_channels)
         self.lamp = Lamp(lamp_channel)
 
@@ -93,98 +150,262 @@ class Photobooth:
         GPIO.setup(self.shutdown_led_channel, GPIO.OUT)
         GPIO.output(self.shutdown_led_channel, GPIO.HIGH)
 
-        # Events detection
-        GPIO.setup(self.trigger_channel, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        #wiringPiISR(trigger_channel, INT_EDGE_FALLING, self.take_picture)
-        GPIO.setup(self.shutdown_channel, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        #wiringPiISR(shutdown_channel, INT_EDGE_FALLING, self.quit)
+        # Events detection (edge interrupts, no polling)
+        self.buttons = ButtonDispatcher(bouncetime=GPIO_BOUNCETIME)
+        self.buttons.register(self.trigger_channel, self.take_picture)
+        self.buttons.register(self.shutdown_channel, self.quit)
 
-        # semaphore on picture taking (to ignore a second clic during a taking
-        # picture sequence)
-        self.picture_time = datetime.now() - timedelta(seconds=10)
+        # the originals are written to the SD card in the background
+        self.writer = ThreadPoolExecutor(max_workers=1)
 
-        # create the compressing process
-        self.queue = Queue()
+        # the camera downloads run on their own worker, the next countdown
+        # can start meanwhile
+        self.capture = CaptureScheduler(self.camera, self.picture_downloaded,
+                                        MAX_PENDING_DOWNLOADS, MAX_QUEUE_DEPTH)
+
+        # create and launch the compressing process, the jobs of its engine
+        # are counted in shared memory for the back-pressure
+        self.queue = PictureQueue()
+        self.compressing = Value('i', 0)
         self.process = Process(target=self.process_new_picture, args=())
+        self.process.start()
+        # connection to the remote (each process has its own)
+        self.client = PhotoClient(HOST, PORT)
         self.run()
 
     def run(self):
-        while True:
-            if not GPIO.input(self.trigger_channel):
-                print('trigger')
-                self.take_picture()
-            if not GPIO.input(self.shutdown_channel):
-                print('shutdown')
-                self.quit()
-
-        # launch the compressing process
-        self.process.start()
+        """ Wait for the buttons and dispatch the pushes """
+        self.buttons.run()
 
-    def take_picture(self):
+    def take_picture(self, edge_time=None):
         """ Launch the photo sequence """
-        # equivalent: if self.taking_picture is False
-        if datetime.now() - self.picture_time < timedelta(seconds=10):
+        # a push that waited behind a sequence is not what the guests want now
+        if edge_time is not None and monotonic() - edge_time > STALE_PUSH:
+            log.debug('Dropping a push received %.1f s ago',
+                      monotonic() - edge_time)
+            return
+        # the previous pictures are still downloading or compressing
+        backlog = self.queue.depth() + self.compressing.value
+        if not self.capture.accepting(backlog):
             print("too soon")
+            log.debug('Busy: %d downloads pending, compression queue depth %d, '
+                      '%d compression jobs', self.capture.pending(),
+                      self.queue.depth(), self.compressing.value)
             return
-        else:
-            print("taking picture")
-            self.picture_time = datetime.now()
-            GPIO.output(self.trigger_led_channel, 0)
+        print("taking picture")
+        GPIO.output(self.trigger_led_channel, 0)
+        if edge_time is not None:
+            log.debug('Button to countdown latency: %.1f ms',
+                      (monotonic() - edge_time) * 1000)
+        name = datetime.now().strftime(self.picture_basename)
+        for index in range(self.burst):
             self.camera.prepare_camera()
-            # python3 range is python2 xrange
-            for i in range(5, 0, -1):
-                self.count_display.display(i)  # Countdown update
-                if i != 0:
-                    sleep(1)
-            self.count_display.display(0)  # Countdown update
+            live_view = None
+            if self.live_view:
+                live_view = LiveView(self.camera.preview_frame,
+                                     self.client.send_frame, LIVE_VIEW_FPS)
+                live_view.start()
+            self.countdown(COUNTDOWN if index == 0 else BURST_COUNTDOWN)
+            if live_view is not None:
+                # the camera must be free for the real capture
+                live_view.stop()
+                log.debug('Live view statistics: %s', live_view.stats())
             self.lamp.on()
-            # Take a picture
-            new_name = self.camera.take_picture(
-                self.picture_path,datetime.now().strftime(self.picture_basename))
-            print('New picture %s', new_name)
-            # Reset the buttons
-            self.count_display.switch_off()
-            GPIO.output(self.trigger_led_channel, GPIO.HIGH)
-            # now put it into the queue
-            if new_name:
-                self.queue.put(new_name)
-            sleep(1)  # TODO : to adjust
+            if self.burst == 1:
+                new_name, strip = name, None
+            else:
+                new_name = burst_picture_name(name, index)
+                strip = (os.path.join(self.picture_path, name), index, self.burst)
+            # Release the shutter, the download goes on in the background
+            taken = self.capture.capture(self.picture_path, new_name, strip)
+            print('Picture taken' if taken else 'Capture failed')
             self.lamp.off()
-            self.count_display.switch_off()
-            GPIO.output(self.shutdown_led_channel, 1)
+            if not taken and strip is not None:
+                # the composite goes on without this picture
+                self.queue.put((new_name, None, strip))
+        # Reset the buttons
+        self.count_display.switch_off()
+        GPIO.output(self.trigger_led_channel, GPIO.HIGH)
+        GPIO.output(self.shutdown_led_channel, 1)
+        # pushes received during the sequence are ignored
+        self.buttons.discard_pending()
+
+    def countdown(self, seconds):
+        """ Countdown on the 7-segment display """
+        for i in range(seconds, 0, -1):
+            self.count_display.display(i)  # Countdown update
+            sleep(1)
+        self.count_display.display(0)  # Countdown update
+
+    def picture_downloaded(self, new_name, data, strip=None):
+        """ Save the original in the background, show the embedded preview
+        right away, then put the picture data into the queue (its screen
+        rendition will replace the preview); called from the camera worker.
+        The pictures of a burst (strip is (composite path, index, count))
+        are only shown once composed """
+        print('New picture %s', new_name)
+        if data is None and strip is None:
+            return
+        if self.camera.deferred:
+            # only the preview, the original is downloaded later
+            if strip is None:
+                self.publish_preview(new_name, data)
+            else:
+                self.queue.put((new_name, data, strip))
+            return
+        if data is not None:
+            self.writer.submit(self.save_original, new_name, data)
+        if strip is None:
+            self.send_preview(new_name, data)
+        self.queue.put((new_name, data, strip))
+        log.debug('Compression queue depth: %d', self.queue.depth())
+
+    def original_downloaded(self, name, data, strip):
+        """ Save an original downloaded after its preview and create its
+        renditions; called from the download thread. The composite of a
+        burst is made again from the originals once the last one is saved.
+        OSError is raised when the original cannot be written: it then stays
+        in the manifest of the downloads and is tried again later """
+        atomic_write(name, data)
+        if strip is None:
+            self.queue.put((name, data, None))
+            return
+        path, index, count = strip
+        if index == count - 1:
+            # the originals are downloaded and saved in order, a failed one
+            # is tried again before the next: they are all on the disk now
+            originals = [burst_picture_name(path, i) for i in range(count)]
+            self.queue.put((path, originals, tuple(strip)))
 
     def process_new_picture(self):
-        """ Process the new picture """
+        """ Process the new pictures until the stop sentinel is received """
+        self.client = PhotoClient(HOST, PORT)
+        engine = ThumbnailEngine(self.renditions, self.thumbnail_preset,
+                                 counter=self.compressing)
+        # composite of the burst being taken
+        composer = None
+
         while True:
-            if not self.queue.empty():
-                name = self.queue.get()
-                if name == 'exit':
-                    return
-                # Create a compressed picture for faster display
-                image_orig = Image.open(name)
-                image_resized = image_orig.resize((800,480),Image.ANTIALIAS)
-                new_image_name = os.path.basename(name)
-                new_image_name = os.path.splitext(new_image_name)[0] + ".jpg"
-                new_path = os.path.join(self.picture_compressed_path, new_image_name)
-                image_resized.save(new_path, quality=98, optimize=True, progressive=True)
-                # send the picture name through a TCP socket
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                    # Connect to server and send data
-                    sock.connect((HOST, PORT))
-                    sock.sendall(bytes(os.path.join(PICTURE_FOLDER, new_image_name) + "\n", "utf-8"))
-            sleep(0.2)
-
-    def quit(self):
+            # blocks until a picture is available
+            item = self.queue.get()
+            if item is PictureQueue.STOP:
+                if composer is not None:
+                    composer.finish()
+                engine.close()
+                self.client.close()
+                log.debug('Compressing process stopped, metrics: %s',
+                          self.queue.stats())
+                return
+            name, data, strip = item
+            log.debug('Picture %s waited %.1f ms in the queue (depth %d)',
+                      name, self.queue.last_wait * 1000, self.queue.depth())
+            if strip is not None and isinstance(data, list):
+                # the paths of the originals of a deferred burst: the
+                # composite of their previews is made again from them
+                path, _, count = strip
+                originals = StripComposer(engine, path, count, self.layout,
+                                          STRIP_TILE_SIZE, self.picture_processed)
+                for index, original in enumerate(data):
+                    originals.add(index, original)
+                continue
+            if strip is not None:
+                # one picture of a composite: made into a tile right away,
+                # composed once they all arrived
+                path, index, count = strip
+                if composer is None or composer.path != path:
+                    # the pictures come in order: the missing pictures of
+                    # the previous burst will not come anymore
+                    if composer is not None:
+                        composer.finish()
+                    composer = StripComposer(engine, path, count, self.layout,
+                                             STRIP_TILE_SIZE, self.picture_processed)
+                composer.add(index, data)
+                continue
+            # Create the compressed pictures for faster display
+            new_image_name = os.path.basename(name)
+            new_image_name = os.path.splitext(new_image_name)[0] + ".jpg"
+            engine.submit(data, new_image_name, self.picture_processed)
+
+    def save_original(self, name, data):
+        """ Write the original picture, called from the writer thread """
+        try:
+            atomic_write(name, data)
+        except OSError as err:
+            log.error('Cannot save the picture %s: %s', name, err)
+
+    def send_preview(self, name, data):
+        """ Send the preview embedded in the new picture as a first screen
+        rendition, before the picture is even decoded """
+        preview = extract_embedded_preview(data)
+        if preview is None:
+            log.debug('No embedded preview in %s', name)
+            return
+        self.publish_preview(name, preview)
+
+    def publish_preview(self, name, preview):
+        """ Write a preview as the screen rendition of a picture and announce
+        it. The remote never scales the pictures up: a preview far smaller
+        than the screen rendition (e.g. an EXIF thumbnail) is skipped, or
+        enlarged in the deferred mode where it stays on screen until the
+        original is downloaded """
+        try:
+            size = Image.open(io.BytesIO(preview)).size
+        except OSError as err:
+            log.error('Invalid preview of %s: %s', name, err)
+            return
+        if (size[0] < self.picture_size[0] * MIN_PREVIEW_SCALE
+                and size[1] < self.picture_size[1] * MIN_PREVIEW_SCALE):
+            if not self.camera.deferred:
+                log.debug('Preview of %s too small (%dx%d)', name, *size)
+                return
+            preview = enlarge(preview, self.picture_size, self.thumbnail_preset)
+        new_image_name = os.path.splitext(os.path.basename(name))[0] + ".jpg"
+        new_path = os.path.join(self.picture_compressed_path, new_image_name)
+        try:
+            atomic_write(new_path, preview)
+        except OSError as err:
+            log.error('Cannot write the preview of %s: %s', name, err)
+            return
+        self.notify_remote(new_image_name, preview)
+
+    def picture_processed(self, renditions):
+        """ Announce the new screen rendition to the remote """
+        data = None
+        if self.transfer:
+            with open(renditions["screen"], 'rb') as rendition:
+                data = rendition.read()
+        self.notify_remote(os.path.basename(renditions["screen"]), data)
+
+    def notify_remote(self, new_image_name, data=None):
+        """ Announce the picture name to the remote, or send it the picture
+        itself in transfer mode """
+        name = os.path.join(PICTURE_FOLDER, new_image_name)
+        if self.transfer:
+            self.client.send_file(name, data)
+        else:
+            self.client.send(name)
+
+    def quit(self, edge_time=None):
         """ Cleanup function """
         log.debug("Quitting")
         log.debug("Cleaning the photobooth")
-        self.queue.put("exit")
+        self.capture.close()
+        log.debug('Capture statistics: %s', self.capture.stats())
+        # no original may be handed over once the queue is stopped (the
+        # pictures not downloaded stay in the manifest) and the originals
+        # are all written before the compressing process is asked to stop
         self.camera.close()
-        self.lamp.set_level(0)
+        self.writer.shutdown(wait=True)
+        self.queue.stop()
+        self.client.close()
+        self.buttons.close()
+        self.lamp.off()
         self.count_display.switch_off()
         GPIO.output(self.trigger_led_channel, 0)
         GPIO.output(self.shutdown_led_channel, 0)
         GPIO.cleanup()
+        # let the compressing process finish the pending pictures
+        self.process.join(timeout=30)
         sys.exit()
 
 
@@ -193,6 +414,13 @@ class Photobooth:
 #################
 
 
+def burst_picture_name(name, index):
+    """ Name (or path) of picture number index (from 0) of the burst whose
+    composite is name """
+    root, ext = os.path.splitext(name)
+    return '%s_%d%s' % (root, index + 1, ext)
+
+
 def parse_args():
     """
     Helper function that parses the command-line arguments
@@ -203,6 +431,40 @@ def parse_args():
         '--path', type=str, help='path to save the pictures', required=True)
     parser.add_argument(
         '--out', type=str, help='path for the compressed pictures', required=True)
+    parser.add_argument(
+        '--grid-out', type=str,
+        help='path for the grid thumbnails (default: OUT_grid)')
+    parser.add_argument(
+        '--web-out', type=str,
+        help='path for the pictures to share (default: OUT_web)')
+    parser.add_argument(
+        '--preset', type=str, choices=sorted(PRESETS),
+        help='quality/speed trade-off of the thumbnails',
+        default=THUMBNAIL_PRESET)
+    parser.add_argument(
+        '--transfer',
+        dest='transfer',
+        action='store_true',
+        help='send the pictures to the remote instead of sharing a folder')
+    parser.add_argument(
+        '--burst', type=int,
+        help='pictures taken per push, composed into one (default: 1)',
+        default=1)
+    parser.add_argument(
+        '--layout', type=str, choices=LAYOUTS,
+        help='layout of the composite of a burst',
+        default=STRIP_LAYOUT)
+    parser.add_argument(
+        '--deferred',
+        dest='deferred',
+        action='store_true',
+        help='keep the pictures on the camera card, show their preview and '
+             'download them when idle (reflex camera only)')
+    parser.add_argument(
+        '--live-view',
+        dest='live_view',
+        action='store_true',
+        help='stream the camera to the remote during the countdown')
     parser.add_argument(
         '--verbose',
         dest='verbose',
@@ -234,10 +496,18 @@ def main():
 
     log.addHandler(console)
 
+    out = os.path.normpath(args.out)
+    extra_renditions = [
+        ("grid", args.grid_out or out + "_grid", PICTURE_GRID_SIZE),
+        ("web", args.web_out or out + "_web", PICTURE_WEB_SIZE)
+    ]
+
     Photobooth(args.path,args.out, PICTURE_BASENAME, PICTURE_SIZE,
                GPIO_TRIGGER_CHANNEL, GPIO_TRIGGER_LED_CHANNEL,
                GPIO_7SEGMENTS_DISPLAY, GPIO_SHUTDOWN_CHANNEL,
-               GPIO_SHUTDOWN_LED_CHANNEL, GPIO_LAMP_CHANNEL)
+               GPIO_SHUTDOWN_LED_CHANNEL, GPIO_LAMP_CHANNEL,
+               extra_renditions, args.preset, args.transfer,
+               max(1, args.burst), args.layout, args.deferred, args.live_view)
     while True:
         sleep(10)
 
@@ -5,18 +5,25 @@ Remote control module for the photobooth project
 """
 
 import argparse
-from bisect import bisect
 import logging
+import math
 import os
 import threading
+from collections import deque
 from datetime import datetime
-from multiprocessing import Process, Queue
-from socketserver import TCPServer
-from time import sleep
+from queue import Empty, Queue
+from time import monotonic
 
 import pygame
 
-from tools.gui import GUIModule
+from tools.assets import AssetAtlas
+from tools.gui import GUIModule, GuiException
+from tools.liveview import FrameMailbox
+from tools.picture_index import PictureIndex
+from tools.playlist import Playlist
+from tools.prefetch import Prefetcher
+from tools.scalers import available_scalers
+from tools.scheduler import Scheduler
 from tools.tcp import PhotoServer
 from tools.remote_log import REMOTE_LOG as log
 
@@ -25,6 +32,16 @@ from tools.remote_log import REMOTE_LOG as log
 ##################
 PICTURE_PATH = datetime.now().strftime("%Y-%m-%d_Photomaton")
 PICTURE_SUFFIX = "_Photomaton.jpeg"
+PREFETCH_WINDOW = 5  # seconds of slideshow decoded in advance
+REVIEW_TIME = 15  # seconds a new picture is shown with the remove button
+MIN_REVIEW_TIME = 3  # same, when other new pictures are waiting
+LIVE_TIMEOUT = 1  # seconds without live view frame before the slideshow goes on
+LIVE_EVENT = pygame.USEREVENT + 1  # wakes the loop up when a frame arrives
+# UI assets: file, size and position on the screen
+UI_ASSETS = {
+    'trash': (os.path.join(os.path.dirname(os.path.abspath(__file__)), 'trash.jpg'),
+              (50, 50), (375, 430))
+}
 
 #####################
 ### Configuration ###
@@ -43,51 +60,91 @@ class Slideshow:
     delete it """
 
     def __init__(self, **kwargs):
-        self.directory = kwargs.get('path')
+        self.directory = os.path.abspath(kwargs.get('path'))
         self.recursive = kwargs.get('recursive')
-        self.filelist = []
+        self.index = PictureIndex(self.directory, self.recursive,
+                                  kwargs.get('index_path'))
+        self.filelist = Playlist()
         self.scan()
         self.size = kwargs.get('size')
+        cache_size = kwargs.get('cache_size', 64)
         self.display = GUIModule("Slideshow",
-                                 self.size, kwargs.get('fullscreen'))
+                                 self.size, kwargs.get('fullscreen'),
+                                 cache_size, kwargs.get('scaler', 'scale'),
+                                 kwargs.get('fps', 30))
         self.display_time = kwargs.get('time')
         self.next = 0
+        # the next (and previous) pictures are decoded in the background
+        self.prefetcher = Prefetcher(self.display)
+        self.prefetch_depth = self.get_prefetch_depth(cache_size)
+        # icons, loaded once
+        self.assets = AssetAtlas(UI_ASSETS)
         self.remove = {
             'enabled': False,
-            'index': -1,
-            'pos': (375, 430),
-            'size': (50, 50)
+            'picture': None
         }
-        self.time_before_next = self.display_time
-        self.scrolling = True
+        # slide advances, reviews and swipes are timers of a single loop
+        self.scheduler = Scheduler()
+        self.current = None
+        self.pending = deque()
+        # pictures removed by the guests: later renditions stay out
+        self.deleted = set()
+        self.review_started = 0
+        self.review_deadline = 0
+        self._advance_timer = None
+        self._review_timer = None
+        # transitions between the slides, at most half of the slide time
+        self.transition_time = min(kwargs.get('transition_time', 0.5),
+                                   self.display_time / 2)
+        self._frame_timer = None
+        # live view of the booth during the countdowns
+        self.live = FrameMailbox()
+        self._live_timer = None
         self.quitting = False
         self.click_x = -1
         self.step = 0.1
         self._queue = kwargs.get('queue')
-        self._monitoring_thread = threading.Thread(target=self._monitor_events)
-        self._monitoring_thread.start()  # Run
 
     def scan(self):
-        """ Scan the photo dir in order to get a list of files """
-        if self.recursive:
-            # Recursively walk all entries in the directory
-            for root, _, filenames in os.walk(
-                    self.directory, followlinks=True):
-                for filename in filenames:
-                    self.filelist.append(os.path.join(root, filename))
-        else:
-            # Add all entries in the directory
-            for item in os.listdir(self.directory):
-                filename = os.path.join(self.directory, item)
-                if os.path.isfile(filename):
-                    self.filelist.append(filename)
-
-        self.filelist = sorted(self.filelist)
-        log.debug("Found the following files during the scan: %s",
-                  str(self.filelist))
+        """ Scan the photo dir in order to get a list of pictures """
+        # only the directories modified since the last run are listed again
+        self.index.update()
+        self.filelist = Playlist(self.index.pictures())
+        log.debug("Found %d pictures during the scan", len(self.filelist))
         self.next = 0
 
-    def display_next(self, text=""):
+    @property
+    def next(self):
+        """ Index of the next picture to display (the playlist cursor, which
+        follows the insertions and removals before it) """
+        return self.filelist.cursor
+
+    @next.setter
+    def next(self, value):
+        self.filelist.cursor = value
+
+    def get_prefetch_depth(self, cache_size):
+        """ Number of pictures to prefetch in each direction: enough for
+        PREFETCH_WINDOW seconds of slideshow, as long as they fit into the
+        cache along with the current one """
+        depth = math.ceil(PREFETCH_WINDOW / max(self.display_time, 1))
+        frame_bytes = self.size[0] * self.size[1] * 4
+        fitting = (cache_size * 1024 * 1024 // frame_bytes - 1) // 2
+        return int(max(1, min(depth, fitting)))
+
+    def prefetch(self):
+        """ Ask for the pictures around the current one, nearest first """
+        count = len(self.filelist)
+        if not count:
+            return
+        wanted = []
+        for i in range(self.prefetch_depth):
+            for index in ((self.next + i) % count, (self.next - 1 - i) % count):
+                if self.filelist[index] not in wanted:
+                    wanted.append(self.filelist[index])
+        self.prefetcher.request(wanted)
+
+    def display_next(self, text="", transition='fade'):
         """ Display the next file in the list """
         log.debug("Displaying next picture")
         if self.next >= len(self.filelist):
@@ -99,24 +156,29 @@ class Slideshow:
             else:
                 self.display.show_message("No pictures available!")
             self.display.apply()
+            self.schedule_advance()
             return None
         else:
             filename = self.filelist[self.next]
             self.next += 1
+            self.display.begin_transition(transition, self.transition_time)
             self.display.clear()
             self.display.show_picture(filename)
             if text:
                 self.display.show_message(text)
             self.display.apply()
-            self.time_before_next = self.display_time
+            self.animate()
+            self.current = filename
+            self.schedule_advance()
+            self.prefetch()
             log.debug("Next picture index is %s", str(self.next))
             log.debug("New picture name is %s", filename)
             return filename
 
-    def display_prev(self, text=""):
+    def display_prev(self, text="", transition='right'):
         """ Display the previous file in the list """
         log.debug("Displaying prev picture")
-        if self.next < 0:
+        if not 0 <= self.next < len(self.filelist):
             self.next = len(self.filelist) - 1
         if not self.filelist:
             self.display.clear()
@@ -125,82 +187,248 @@ class Slideshow:
             else:
                 self.display.show_message("No pictures available!")
             self.display.apply()
+            self.schedule_advance()
             return None
         else:
             filename = self.filelist[self.next]
-            self.next -= 1
+            # wrapped at once: the cursor must stay a position of the
+            # playlist for the insertions and removals to move it
+            self.next = (self.next - 1) % len(self.filelist)
+            self.display.begin_transition(transition, self.transition_time)
             self.display.clear()
             self.display.show_picture(filename)
             if text:
                 self.display.show_message(text)
             self.display.apply()
-            self.time_before_next = self.display_time
+            self.animate()
+            self.current = filename
+            self.schedule_advance()
+            self.prefetch()
             log.debug("Next picture index is %s", str(self.next))
             log.debug("New picture name is %s", filename)
             return filename
 
-    def _monitor_events(self):
-        """ Monitor the Slideshow events """
-        while not self.quitting:
-            self.handle_event(pygame.event.wait())
+    def schedule_advance(self):
+        """ (Re)start the timer of the next slide """
+        self.scheduler.cancel(self._advance_timer)
+        self._advance_timer = self.scheduler.call_later(self.display_time,
+                                                        self.advance)
+
+    def advance(self):
+        """ Slide timer: show the next picture unless one is reviewed """
+        self._advance_timer = None
+        if not self.remove['enabled']:
+            self.display_next()
+
+    def animate(self):
+        """ Schedule the next frame of the running transition """
+        self.scheduler.cancel(self._frame_timer)
+        self._frame_timer = None
+        if self.display.transition_running():
+            self._frame_timer = self.scheduler.call_later(self.display.frame_delay(),
+                                                          self.step_transition)
+
+    def step_transition(self):
+        """ Frame timer: draw one frame of the transition """
+        self._frame_timer = None
+        if self.display.step_transition():
+            self.animate()
+
+    def show_current(self):
+        """ Show again the slide displayed before a review """
+        if self.current is None or self.current not in self.filelist:
+            self.display_next()
+            return
+        log.debug('Displaying picture %s', self.current)
+        self.display.clear()
+        self.display.show_picture(self.current)
+        self.display.apply()
+        self.schedule_advance()
 
     def run(self):
-        """ Main loop """
+        """ Main loop: the only place where the state of the slideshow
+        changes. Input events, new pictures and timers are handled here one
+        after the other, the other threads only post messages to it (pygame
+        events, the queue of new pictures and the live view mailbox) """
+        self.display_next()
         while not self.quitting:
-            picture = self.display_next()
-            log.debug('Displaying picture %s', picture)
-            while self.time_before_next > 0 and self.scrolling and not self.quitting:
-                # when a new messages arrives, we check whether it is a valid
-                # file
-                if not self._queue.empty():
-                    self.deal_with_new_picture(picture)
-                sleep(self.step)
-                self.time_before_next -= self.step
-
-    def deal_with_new_picture(self, picture):
+            # wait for an input event, the next timer or at most one step
+            # (new pictures are looked for at least every step)
+            timeout = self.scheduler.time_to_next()
+            if timeout is None or timeout > self.step:
+                timeout = self.step
+            events = pygame.event.get()
+            if not events and timeout >= 0.001:
+                events = [pygame.event.wait(int(timeout * 1000))]
+            self.handle_events(events)
+            if self.quitting:
+                break
+            self.show_live_frame()
+            self.receive_pictures()
+            self.scheduler.run_pending()
+
+    def handle_events(self, events):
+        """ Handle the pending input events, in order """
+        for event in events:
+            self.handle_event(event)
+            if self.quitting:
+                return
+
+    def post_frame(self, data):
+        """ Hand a live view frame over to the loop (from the server thread),
+        frames not shown yet are dropped """
+        self.live.write(data)
+        pygame.event.post(pygame.event.Event(LIVE_EVENT))
+
+    def show_live_frame(self):
+        """ Show the latest live view frame, if any; a picture being
+        reviewed stays on screen """
+        frame = self.live.read(0)
+        if frame is None:
+            return
+        if not self.remove['enabled']:
+            self.scheduler.cancel(self._advance_timer)
+            self._advance_timer = None
+            # a running transition must not paint over the frame
+            self.scheduler.cancel(self._frame_timer)
+            self._frame_timer = None
+            self.display.finish_transition()
+            try:
+                self.display.clear()
+                self.display.show_frame(frame)
+                self.display.apply()
+            except GuiException as exc:
+                log.debug('%s', exc)
+            self.scheduler.cancel(self._live_timer)
+            self._live_timer = self.scheduler.call_later(LIVE_TIMEOUT, self.live_ended)
+        self.live.release()
+
+    def live_ended(self):
+        """ Live timer: no frame for a while, the slideshow goes on """
+        self._live_timer = None
+        if not self.remove['enabled']:
+            self.show_current()
+
+    def receive_pictures(self):
+        """ Take the names of the new pictures out of the queue """
+        while True:
+            try:
+                name = self._queue.get_nowait()
+            except Empty:
+                return
+            self.deal_with_new_picture(name)
+
+    def deal_with_new_picture(self, name):
         """Function that handles incoming pictures"""
-        new_picture = os.path.join(self.directory,
-                                   self._queue.get())
+        new_picture = os.path.normpath(os.path.join(self.directory, name))
         log.debug('Trying to add new picture %s to the file list',
                   new_picture)
         # we check whether the new picture really exists
-        if os.path.exists(new_picture):
-            # just in case we discard any previous clickdown event
-            self.click_x = -1
-            # we add the new picture at the end of the list
-            self.remove['index'] = bisect(self.filelist, new_picture)
-            self.filelist.insert(self.remove['index'], new_picture)
-            log.debug('File list is now: %s', str(self.filelist))
-            # now we display the picture during 15s
-            self.display.show_picture(new_picture)
-            self.remove['enabled'] = True
-            log.debug('The remove button is now enabled')
-            self.remove['size'] = self.display.show_picture(
-                "trash.jpg", self.remove["size"], self.remove['pos'], alpha=255)
-            log.debug('Size of the display button is %s', self.remove["size"])
-            self.display.apply()
-            for _ in range(0, 150):
-                sleep(self.step)
-                if not self.remove['enabled']:
-                    break
-            self.remove['enabled'] = False
-            self.remove['index'] = -1
-            log.debug('The remove button is now disabled')
-            log.debug('Displaying picture %s', picture)
-            self.display.clear()
-            self.display.show_picture(picture)
-            self.display.apply()
+        if not os.path.exists(new_picture):
+            return
+        if new_picture in self.deleted:
+            # e.g. the original of a deferred download, arrived after the
+            # guest removed its preview
+            log.debug('Discarding %s, removed by the guest', new_picture)
+            try:
+                os.remove(new_picture)
+            except OSError as exc:
+                log.error('Cannot remove %s: %s', new_picture, exc)
+            return
+        if new_picture == self.remove['picture']:
+            # a better rendition of the picture being reviewed (the booth
+            # first sends the preview embedded in the picture)
+            log.debug('New rendition of picture %s', new_picture)
+            self.show_review()
+            return
+        if new_picture in self.pending:
+            return
+        if new_picture in self.filelist:
+            # a new rendition of a picture already reviewed (the original
+            # of a deferred download, a burst composite): no second review
+            if new_picture == self.current and not self.remove['enabled']:
+                log.debug('New rendition of the current picture %s', new_picture)
+                self.display.clear()
+                self.display.show_picture(new_picture)
+                self.display.apply()
+            return
+        self.pending.append(new_picture)
+        if self.remove['picture'] is None:
+            self.start_review()
+        else:
+            # the pictures are shown in order, the current one only stays
+            # on screen for MIN_REVIEW_TIME once others are waiting
+            self.set_review_deadline(self.review_started + MIN_REVIEW_TIME)
+
+    def start_review(self):
+        """ Show the oldest waiting picture with the remove button """
+        new_picture = self.pending.popleft()
+        # just in case we discard any previous clickdown event
+        self.click_x = -1
+        # we add the new picture at its place in the list
+        self.filelist.add(new_picture)
+        log.debug('File list now holds %d pictures', len(self.filelist))
+        self.scheduler.cancel(self._advance_timer)
+        self._advance_timer = None
+        self.remove['enabled'] = True
+        self.remove['picture'] = new_picture
+        log.debug('The remove button is now enabled')
+        self.show_review()
+        self.review_started = monotonic()
+        self.review_deadline = None
+        self.set_review_deadline(self.review_started +
+                                 (MIN_REVIEW_TIME if self.pending else REVIEW_TIME))
+
+    def show_review(self):
+        """ Draw the reviewed picture and the remove button """
+        self.display.clear()
+        self.display.show_picture(self.remove['picture'])
+        self.display.show_surface(*self.assets.placed('trash'))
+        self.display.apply()
+
+    def set_review_deadline(self, deadline):
+        """ End the current review at deadline (or sooner) """
+        if self.review_deadline is not None and self.review_deadline <= deadline:
+            return
+        self.review_deadline = deadline
+        self.scheduler.cancel(self._review_timer)
+        self._review_timer = self.scheduler.call_at(deadline, self.end_review)
+
+    def end_review(self):
+        """ Review timer: go on with the next new picture or the slideshow """
+        self.scheduler.cancel(self._review_timer)
+        self._review_timer = None
+        self.remove['enabled'] = False
+        self.remove['picture'] = None
+        log.debug('The remove button is now disabled')
+        if self.pending:
+            self.start_review()
+        else:
+            self.show_current()
+
+    def remove_picture(self, picture):
+        """ Delete the reviewed picture """
+        if picture is None:
+            return
+        log.debug('Removing the picture %s', picture)
+        self.deleted.add(picture)
+        try:
+            os.remove(picture)
+        except OSError as exc:
+            log.error('Cannot remove %s: %s', picture, exc)
+        index = self.filelist.index(picture)
+        if index >= 0:
+            del self.filelist[index]
+        self.end_review()
 
     def handle_event(self, event):
         """ Handle events of the GUI"""
         if event.type == pygame.MOUSEBUTTONUP:
             log.debug('Received a new event: %s', str(event))
-            pos = pygame.mouse.get_pos()
-            self.handle_mouseup(pos)
+            self.handle_mouseup(event.pos)
         elif event.type == pygame.MOUSEBUTTONDOWN:
             log.debug('Received a new event: %s', str(event))
-            pos = pygame.mouse.get_pos()
-            self.handle_mousedown(pos)
+            self.handle_mousedown(event.pos)
         elif event.type == pygame.KEYDOWN:
             log.debug('Received a new event: %s', str(event))
             self.handle_key_pressed(event.key)
@@ -218,15 +446,9 @@ class Slideshow:
         """ Handle a clic (mouseup) or a touch on the screen """
         # we check whether the remove button is enabled and
         # it is a click within the remove button
-        if self.remove['enabled'] and self.remove['pos'][0] <= pos[0] and pos[0] <= self.remove['pos'][0] + \
-                self.remove['size'][0] and self.remove['pos'][1] <= pos[1] and pos[1] <= self.remove['pos'][1] + self.remove['size'][1]:
+        if self.remove['enabled'] and self.assets.hit('trash', pos):
             log.debug('Click on the remove button')
-            log.debug('Removing the picture %s',
-                      self.filelist[self.remove['index']])
-            os.remove(self.filelist[self.remove['index']])
-            del self.filelist[self.remove['index']]
-            self.remove['index'] = -1
-            self.remove['enabled'] = False
+            self.remove_picture(self.remove['picture'])
             return
         # if the remove button is disabled and we registered we mouseup
         # beforehand
@@ -240,7 +462,7 @@ class Slideshow:
                 # we reset the click variable
                 self.click_x = -1
                 # and we display the next picture
-                self.display_next()
+                self.display_next(transition='left')
                 return
             # if the click is within the leftmost 20th of the screen
             # or we swiped toward the left direction for more than 1/10th
@@ -250,7 +472,7 @@ class Slideshow:
                 # we reset the click variable
                 self.click_x = -1
                 # and we display the previous picture
-                self.display_prev()
+                self.display_prev(transition='right')
                 return
             # otherwise we ignore the click
             # and reset the previous position
@@ -268,6 +490,10 @@ class Slideshow:
     def _teardown(self):
         """ Display closing method """
         self.quitting = True
+        self.scheduler.clear()
+        self.display.finish_transition()
+        self.prefetcher.stop()
+        self.index.close()
         self.display.teardown()
 
 
@@ -302,6 +528,36 @@ def parse_args():
         default='localhost')
     parser.add_argument(
         '--time', type=int, help='slideshow frequency', default=1)
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        help='memory budget of the picture cache in MB',
+        default=64)
+    parser.add_argument(
+        '--index',
+        type=str,
+        dest='index_path',
+        help='file of the picture index (by default in the local cache '
+             'directory, never on a network share)',
+        default=None)
+    parser.add_argument(
+        '--scaler',
+        type=str,
+        choices=available_scalers(),
+        help='backend scaling the pictures to the screen size '
+             '(see benchmarks/bench_scalers.py)',
+        default='scale')
+    parser.add_argument(
+        '--transition-time',
+        type=float,
+        help='duration of the transitions between the pictures in seconds '
+             '(0 for none)',
+        default=0.5)
+    parser.add_argument(
+        '--fps',
+        type=int,
+        help='target frame rate of the transitions',
+        default=30)
     parser.add_argument(
         '--verbose',
         dest='verbose',
@@ -340,13 +596,6 @@ def main():
 
     queue = Queue()
 
-    # Init the TCP server
-    TCPServer.allow_reuse_address = True
-    server = PhotoServer(address=args.address, port=args.port, queue=queue)
-    server_process = Process(target=server.serve_forever)
-    server_process.daemon = True
-    server_process.start()
-
     # Start the slideshow
     slideshow = Slideshow(
         size=tuple(args.size),
@@ -354,10 +603,24 @@ def main():
         path=args.path,
         queue=queue,
         fullscreen=args.fullscreen,
+        cache_size=args.cache_size,
+        index_path=args.index_path,
+        scaler=args.scaler,
+        transition_time=args.transition_time,
+        fps=args.fps,
         recursive=True)
+
+    # Init the TCP server, its event loop runs in a thread of this process
+    server = PhotoServer(address=args.address, port=args.port, queue=queue,
+                         directory=args.path, on_frame=slideshow.post_frame)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
     slideshow.run()
 
-    server_process.terminate()
+    server.shutdown()
+    server_thread.join()
     return 0
 
 
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+UI assets (icons, overlays) loaded once at startup
+"""
+
+import pygame
+
+from .gui import GuiException
+from .remote_log import REMOTE_LOG as log
+
+
+class AssetAtlas:
+    """
+    Display-ready surfaces of the UI assets
+
+    assets is a dictionary {name: (filename, size, position)}: every asset is
+    decoded, scaled to size and converted to the display format when the
+    atlas is created (the display must already be initialized), other sizes
+    are created on first use and kept. rect() gives the area of an asset on
+    the screen for the hit tests.
+    """
+
+    def __init__(self, assets):
+        self._images = {}
+        self._variants = {}
+        self._rects = {}
+        for name, (filename, size, position) in assets.items():
+            try:
+                image = pygame.image.load(filename)
+            except pygame.error as exc:
+                raise GuiException("ERROR: Can't open asset '" + filename + "': " +
+                                   str(exc))
+            # keep the transparency of the assets that have one
+            if image.get_alpha() is not None or image.get_colorkey() is not None:
+                image = image.convert_alpha()
+            else:
+                image = image.convert()
+            self._images[name] = image
+            self._rects[name] = pygame.Rect(position, size)
+            self.get(name, size)
+            log.debug('Loaded asset %s from %s', name, filename)
+
+    def get(self, name, size=None):
+        """ Surface of an asset at the given size (its default one if None) """
+        if size is None:
+            size = self._rects[name].size
+        size = tuple(size)
+        surface = self._variants.get((name, size))
+        if surface is None:
+            image = self._images[name]
+            if image.get_size() == size:
+                surface = image
+            else:
+                surface = pygame.transform.smoothscale(image, size)
+            self._variants[(name, size)] = surface
+        return surface
+
+    def rect(self, name):
+        """ Area of an asset on the screen """
+        return self._rects[name].copy()
+
+    def placed(self, name):
+        """ (surface, position) of an asset, ready to be shown """
+        return self.get(name), self._rects[name].topleft
+
+    def hit(self, name, pos):
+        """ Whether a position is within an asset """
+        return self._rects[name].collidepoint(pos)
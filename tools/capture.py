@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Staged capture: the camera I/O runs on its own worker so that the next
+countdown can start while the previous picture is still downloading
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from time import monotonic
+
+from .photo_log import PHOTO_LOG as log
+
+
+class CaptureScheduler:
+    """
+    Single camera worker: shutter releases and downloads are run one after
+    the other (gphoto2 does not support concurrent calls on a camera), in
+    the order they were asked for
+
+    capture() returns once the shutter was released, the download is then
+    queued and on_picture(path, data, context) is called from the worker
+    when it is done (data is None if the download failed). accepting()
+    tells whether a new sequence can start: at most max_pending downloads
+    may be behind and at most max_queue pictures may wait for the
+    compressing process or be compressed.
+    """
+
+    def __init__(self, camera, on_picture, max_pending=1, max_queue=4):
+        self.camera = camera
+        self.on_picture = on_picture
+        self.max_pending = max_pending
+        self.max_queue = max_queue
+        self._worker = ThreadPoolExecutor(max_workers=1)
+        self._lock = threading.Lock()
+        self._pending = 0
+        # latency counters, in seconds
+        self.triggers = 0
+        self.count = 0
+        self.trigger_time = 0.
+        self.download_time = 0.
+        self.max_download_time = 0.
+
+    def pending(self):
+        """ Number of pictures taken and not downloaded yet """
+        with self._lock:
+            return self._pending
+
+    def accepting(self, backlog=0):
+        """ Whether a new sequence can start without piling up work, backlog
+        is the number of pictures queued or being compressed """
+        return self.pending() <= self.max_pending and backlog <= self.max_queue
+
+    def capture(self, path, name, context=None):
+        """ Release the shutter (waiting for the worker to be free), queue the
+        download and return whether the picture was taken """
+        start = monotonic()
+        shot = self._worker.submit(self.camera.trigger, path, name).result()
+        if shot is None:
+            return False
+        with self._lock:
+            self._pending += 1
+            self.triggers += 1
+            self.trigger_time += monotonic() - start
+        self._worker.submit(self._download, shot, context)
+        return True
+
+    def _download(self, shot, context):
+        """ Worker: download a picture and hand it over """
+        start = monotonic()
+        try:
+            try:
+                name, data = self.camera.download(shot, context)
+            except Exception as err:  # the worker must survive a bad picture
+                log.error('Cannot download the new picture: %s', err)
+                name, data = None, None
+            elapsed = monotonic() - start
+            with self._lock:
+                self.count += 1
+                self.download_time += elapsed
+                self.max_download_time = max(self.max_download_time, elapsed)
+            log.debug('Picture %s downloaded in %.1f ms', name, elapsed * 1000)
+            # called for a failed download too: a burst goes on without it
+            self.on_picture(name, data or None, context)
+        except Exception as err:
+            log.error('Cannot process the new picture: %s', err)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self):
+        """ Latency counters (times in milliseconds) """
+        with self._lock:
+            return {
+                'triggers': self.triggers,
+                'count': self.count,
+                'pending': self._pending,
+                'mean_trigger_ms': self.trigger_time * 1000 / max(self.triggers, 1),
+                'mean_download_ms': self.download_time * 1000 / max(self.count, 1),
+                'max_download_ms': self.max_download_time * 1000
+            }
+
+    def close(self):
+        """ Wait for the pending downloads and stop the worker """
+        self._worker.shutdown(wait=True)
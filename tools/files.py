@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Utils: file writing
+"""
+
+import os
+import threading
+
+
+def atomic_write(path, data):
+    """
+    Write data (bytes or str) to path so that readers never see half a file:
+    it is written under a temporary name in the same directory, then renamed.
+    The directory is created if needed; raises OSError.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # unique per process and thread: several writers may target one file
+    tmp_path = os.path.join(directory, '.%s.%d.%d.tmp' % (
+        os.path.basename(path), os.getpid(), threading.get_ident()))
+    mode = 'w' if isinstance(data, str) else 'wb'
+    try:
+        with open(tmp_path, mode) as tmp:
+            tmp.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -3,9 +3,20 @@
 GUI-related classes
 """
 
+import io
+import os
+from time import perf_counter
+
 import pygame
 
 from .remote_log import REMOTE_LOG as log
+from .scalers import get_scaler
+from .surface_cache import SurfaceCache
+
+MESSAGE_CACHE_SIZE = 16  # memory budget of the rendered messages in MB
+# Transitions: 'fade' cross-fades, 'left' and 'right' slide the new frame in
+# from the right (moving left) or from the left (moving right)
+TRANSITIONS = ('fade', 'left', 'right')
 
 
 class GuiException(Exception):
@@ -14,10 +25,25 @@ class GuiException(Exception):
     """
 
 
+# Fonts already loaded, by size
+FONTS = {}
+
+
+def get_font(size):
+    """
+    Default font at the given size, loaded once
+    """
+    font = FONTS.get(size)
+    if font is None:
+        font = FONTS[size] = pygame.font.Font(None, size)
+    return font
+
+
 class GUIModule:
     """ GUI Display using PyGame """
 
-    def __init__(self, name, size, fullscreen=True):
+    def __init__(self, name, size, fullscreen=True, cache_size=64, scaler='scale',
+                 fps=30):
         # Call init routines
         pygame.init()
 
@@ -36,23 +62,193 @@ class GUIModule:
             # windowed mode is for debug so we also show the cursor
             pygame.mouse.set_visible(True)
 
+        # Decoding and scaling of the pictures
+        try:
+            self.scaler = get_scaler(scaler)
+        except ValueError as exc:
+            raise GuiException("ERROR: " + str(exc))
+        log.debug('Scaling the pictures with %s (smoothscale backend: %s)',
+                  scaler, pygame.transform.get_smoothscale_backend())
+
+        # Decoded and scaled pictures (cache_size is in MB)
+        self.cache = SurfaceCache(cache_size)
+        # Rendered messages
+        self.message_cache = SurfaceCache(MESSAGE_CACHE_SIZE)
+
+        # Dirty rectangles: what is drawn on the screen since the last clear
+        # and what changed since the last update
+        self.background = None
+        self.drawn_rects = []
+        self.damaged_rects = []
+        self.surface_list = []
+
+        # Frame time counters
+        self.frame_count = 0
+        self.frame_time = 0.
+        self.last_frame_time = 0.
+        self.updated_pixels = 0
+
+        # Transitions: the old and the new frame are kept in two back
+        # buffers allocated once, each step only blits them to the screen
+        self.fps = fps
+        self.buffers = (pygame.Surface(size).convert(), pygame.Surface(size).convert())
+        self.transition = None
+        # live view frames are scaled into a surface kept between frames
+        self.frame_surface = None
+        self.transition_count = 0
+        self.transition_frames = 0
+        self.dropped_frames = 0
+
         # Clear screen
         self.clear()
         self.apply()
 
     def clear(self, color=(46, 52, 54)):
         """
-        Clears the screen
+        Clears the screen (only the parts drawn since the last clear)
         """
-        self.screen.fill(color)
+        # a running transition jumps to its end
+        if self.transition is not None and self.transition['start'] is not None:
+            self.finish_transition()
+        if color != self.background:
+            self.screen.fill(color)
+            self.damaged_rects = [self.screen.get_rect()]
+            self.background = color
+        else:
+            for rect in self.drawn_rects:
+                self.screen.fill(color, rect)
+            self.damaged_rects.extend(self.drawn_rects)
+        self.drawn_rects = []
         self.surface_list = []
 
     def apply(self):
         """
-        Updates the display
+        Updates the changed regions of the display
         """
+        start = perf_counter()
         for surface in self.surface_list:
-            self.screen.blit(surface[0], surface[1])
+            rect = self.screen.blit(surface[0], surface[1])
+            self.drawn_rects.append(rect)
+            self.damaged_rects.append(rect)
+        self.surface_list = []
+        if self.transition is not None and self.transition['start'] is None:
+            # the new frame goes to the back buffer, step_transition() shows it
+            self.buffers[1].blit(self.screen, (0, 0))
+            self.damaged_rects = []
+            self.transition['start'] = self.transition['last'] = perf_counter()
+            self.transition['frame'] = 0
+            return
+        rects = merge_rects(self.damaged_rects)
+        self.damaged_rects = []
+        if rects:
+            pygame.display.update(rects)
+        self.last_frame_time = perf_counter() - start
+        self.frame_count += 1
+        self.frame_time += self.last_frame_time
+        self.updated_pixels += sum(rect.width * rect.height for rect in rects)
+
+    def invalidate(self):
+        """
+        Makes the next apply update the whole screen
+        """
+        self.damaged_rects = [self.screen.get_rect()]
+
+    def stats(self):
+        """
+        Rendering counters (times in milliseconds)
+        """
+        return {
+            'frames': self.frame_count,
+            'last_frame_ms': self.last_frame_time * 1000,
+            'mean_frame_ms': self.frame_time * 1000 / max(self.frame_count, 1),
+            'mean_updated_pixels': self.updated_pixels // max(self.frame_count, 1),
+            'transitions': self.transition_count,
+            'transition_frames': self.transition_frames,
+            'dropped_frames': self.dropped_frames
+        }
+
+    def begin_transition(self, kind='fade', duration=0.5):
+        """
+        Makes the next frame (from clear() to apply()) replace the current
+        one with a transition, shown by calling step_transition() until it
+        returns False
+        """
+        if kind not in TRANSITIONS:
+            raise GuiException("Invalid transition: " + str(kind))
+        if self.transition is not None:
+            self.finish_transition()
+        if duration <= 0:
+            return
+        self.buffers[0].blit(self.screen, (0, 0))
+        self.transition = {'kind': kind, 'duration': duration, 'start': None}
+        self.transition_count += 1
+
+    def transition_running(self):
+        """
+        Whether a transition waits for its next step
+        """
+        return self.transition is not None and self.transition['start'] is not None
+
+    def frame_delay(self):
+        """
+        Seconds before the next step of the running transition is due
+        """
+        if not self.transition_running():
+            return 0.
+        return max(0., self.transition['last'] + 1. / self.fps - perf_counter())
+
+    def step_transition(self):
+        """
+        Draws the frame of the running transition for the current time,
+        returns whether it goes on
+        """
+        if not self.transition_running():
+            return False
+        start = perf_counter()
+        transition = self.transition
+        progress = (start - transition['start']) / transition['duration']
+        if progress >= 1.:
+            self.finish_transition()
+            return False
+        # frames that should have been shown since the last one
+        frame = int((start - transition['start']) * self.fps)
+        if frame > transition['frame'] + 1:
+            self.dropped_frames += frame - transition['frame'] - 1
+        transition['frame'] = max(frame, transition['frame'] + 1)
+        transition['last'] = start
+        old, new = self.buffers
+        if transition['kind'] == 'fade':
+            self.screen.blit(old, (0, 0))
+            new.set_alpha(int(255 * progress))
+            self.screen.blit(new, (0, 0))
+            new.set_alpha(None)
+        else:
+            shift = int(self.size[0] * progress)
+            if transition['kind'] == 'left':
+                self.screen.blit(old, (-shift, 0))
+                self.screen.blit(new, (self.size[0] - shift, 0))
+            else:
+                self.screen.blit(old, (shift, 0))
+                self.screen.blit(new, (shift - self.size[0], 0))
+        pygame.display.update()
+        self.transition_frames += 1
+        self.last_frame_time = perf_counter() - start
+        self.frame_count += 1
+        self.frame_time += self.last_frame_time
+        self.updated_pixels += self.size[0] * self.size[1]
+        return True
+
+    def finish_transition(self):
+        """
+        Shows the new frame of a transition right away
+        """
+        transition, self.transition = self.transition, None
+        if transition is None:
+            return
+        if transition['start'] is None:
+            # nothing drawn yet: the next apply updates the screen directly
+            return
+        self.screen.blit(self.buffers[1], (0, 0))
         pygame.display.update()
 
     def get_size(self):
@@ -68,31 +264,100 @@ class GUIModule:
         # Use window size if none given
         if size == (0, 0):
             size = self.size
-        try:
-            # Load image from file
-            image = pygame.image.load(filename)
-        except pygame.error as exc:
-            raise GuiException("ERROR: Can't open image '" + filename + "': " +
-                               exc.message)
-        # Extract image size and determine scaling
-        image_size = image.get_rect().size
-        image_scale = min([min(a, b) / b for a, b in zip(size, image_size)])
-        # New image size
-        new_size = [int(a * image_scale) for a in image_size]
+        surface = self.load_picture(filename, size, flip, alpha)
+        new_size = surface.get_size()
         # Update offset
         offset = tuple(a + int((b - c) / 2)
                        for a, b, c in zip(offset, size, new_size))
-        # Apply scaling and display picture
-        image = pygame.transform.scale(image, new_size).convert()
-        image.set_alpha(alpha)
-        # Create surface and blit the image to it
-        surface = pygame.Surface(new_size)
-        surface.blit(image, (0, 0))
-        if flip:
-            surface = pygame.transform.flip(surface, True, False)
         self.surface_list.append((surface, offset))
         return new_size
 
+    def preload_picture(self, filename, size=(0, 0)):
+        """
+        Load a picture into the cache (called from the prefetching thread)
+        """
+        if size == (0, 0):
+            size = self.size
+        key = self._picture_key(filename, size, False, 255)
+        # not a lookup of the display: neither a hit nor a miss
+        if key not in self.cache:
+            self.cache.put(key, self._decode_picture(filename, size, False, 255))
+
+    @staticmethod
+    def _picture_key(filename, size, flip, alpha):
+        """
+        Cache key of a picture
+        """
+        try:
+            return (filename, os.stat(filename).st_mtime_ns, tuple(size), flip, alpha)
+        except OSError as exc:
+            raise GuiException("ERROR: Can't open image '" + filename + "': " +
+                               str(exc))
+
+    def show_frame(self, data):
+        """
+        Display of a live view frame (JPEG data), scaled to fill the screen
+        """
+        try:
+            image = pygame.image.load(io.BytesIO(data), 'frame.jpg')
+        except pygame.error as exc:
+            raise GuiException("ERROR: Can't decode a live frame: " + str(exc))
+        scale = min(a / b for a, b in zip(self.size, image.get_size()))
+        new_size = tuple(max(1, int(a * scale)) for a in image.get_size())
+        # smoothscale writes into a surface of the size and format of the
+        # frames, allocated again only when they change
+        frame = self.frame_surface
+        if frame is None or frame.get_size() != new_size or \
+                frame.get_bitsize() != image.get_bitsize() or \
+                frame.get_masks() != image.get_masks():
+            frame = self.frame_surface = pygame.Surface(new_size, 0, image)
+        if image.get_bitsize() in (24, 32):
+            pygame.transform.smoothscale(image, new_size, frame)
+        else:
+            pygame.transform.scale(image, new_size, frame)
+        self.surface_list.append((frame, self.align(new_size, 1, 1)))
+        return new_size
+
+    def show_surface(self, surface, offset=(0, 0)):
+        """
+        Display of an already rendered surface
+        """
+        self.surface_list.append((surface, offset))
+        return surface.get_size()
+
+    def load_picture(self, filename, size, flip=False, alpha=255):
+        """
+        Surface of a picture scaled to fit into size, from the cache if
+        possible
+        """
+        key = self._picture_key(filename, size, flip, alpha)
+        surface = self.cache.get(key)
+        if surface is None:
+            surface = self._decode_picture(filename, size, flip, alpha)
+            self.cache.put(key, surface)
+        return surface
+
+    def _decode_picture(self, filename, size, flip, alpha):
+        """
+        Surface of a picture scaled to fit into size, decoded from the file
+        """
+        try:
+            # Load image from file, scaled to fit into size
+            image = self.scaler(filename, size)
+        except (pygame.error, OSError, ValueError) as exc:
+            raise GuiException("ERROR: Can't open image '" + filename + "': " +
+                               str(exc))
+        if alpha == 255:
+            surface = image
+        else:
+            image.set_alpha(alpha)
+            # Create surface and blit the image to it
+            surface = pygame.Surface(image.get_size()).convert()
+            surface.blit(image, (0, 0))
+        if flip:
+            surface = pygame.transform.flip(surface, True, False)
+        return surface
+
     def show_message(self,
                      msg,
                      color=(0, 0, 0),
@@ -100,15 +365,20 @@ class GUIModule:
                      transparency=True,
                      outline=(245, 245, 245)):
         """Pre-rendering of a message"""
-        # Choose font
-        font = pygame.font.Font(None, 144)
-        # Wrap and render text
-        wrapped_text, text_height = wrap_text(msg, font, self.size)
-        rendered_text = self.render_text(wrapped_text, text_height, 1, 1, font,
-                                         color, background, transparency,
-                                         outline)
-
-        self.surface_list.append((rendered_text, (0, 0)))
+        key = (msg, 144, color, background, transparency, outline, tuple(self.size))
+        rendered_text = self.message_cache.get(key)
+        if rendered_text is None:
+            # Choose font
+            font = get_font(144)
+            # Wrap and render text
+            wrapped_text, text_height = wrap_text(msg, font, self.size)
+            rendered_text, _ = self.render_text(wrapped_text, text_height, 1, 1,
+                                                font, color, background,
+                                                transparency, outline)
+            self.message_cache.put(key, rendered_text)
+
+        self.surface_list.append(
+            (rendered_text, self.align(rendered_text.get_size(), 1, 1)))
 
     def show_button(self,
                     text,
@@ -120,30 +390,29 @@ class GUIModule:
                     outline=(230, 230, 230)):
         """Pre-rendering of a button"""
         # Choose font
-        font = pygame.font.Font(None, 72)
+        font = get_font(72)
         text_size = font.size(text)
         if size == (0, 0):
             size = (text_size[0] + 4, text_size[1] + 4)
         offset = ((size[0] - text_size[0]) // 2, (size[1] - text_size[1]) // 2)
 
-        # Create Surface object and fill it with the given background
-        surface = pygame.Surface(self.size)
+        # Create Surface object (as large as the button) and fill it with
+        # the given background
+        surface = pygame.Surface(size)
         surface.fill(background)
 
         # Render text
         rendered_text = font.render(text, 1, color)
-        surface.blit(rendered_text, pos)
+        surface.blit(rendered_text, offset)
 
         # Render outline
-        pygame.draw.rect(surface, outline,
-                         (pos[0] - offset[0], pos[1] - offset[0], size[0],
-                          size[1]), 1)
+        pygame.draw.rect(surface, outline, (0, 0, size[0], size[1]), 1)
 
         # Make background color transparent
         if transparency:
             surface.set_colorkey(background)
 
-        self.surface_list.append((surface, (0, 0)))
+        self.surface_list.append((surface, (pos[0] - offset[0], pos[1] - offset[1])))
         log.debug(
             'Successfully drew button with text %(text)s, position %(position)s and size %(size)s',
             {'text': text,
@@ -153,37 +422,28 @@ class GUIModule:
 
     def render_text(self, text, text_height, valign, halign, font, color,
                     background, transparency, outline):
-        """Pre-rendering of some text"""
-        # Determine vertical position
-        if valign == 0:  # top aligned
-            voffset = 0
-        elif valign == 1:  # centered
-            voffset = int((self.size[1] - text_height) / 2)
-        elif valign == 2:  # bottom aligned
-            voffset = self.size[1] - text_height
-        else:
-            raise GuiException("Invalid valign argument: " + str(valign))
+        """Pre-rendering of some text, returns the surface (as large as the
+        text) and its position on the screen"""
+        # Render the lines, the outline takes one more pixel on each side
+        lines = [(font.render(line, 1, color), font.render(line, 1, outline))
+                 for line in text]
+        width = max([maintext.get_width() for maintext, _ in lines] + [0]) + 2
+        offset = self.align((width, text_height + 2), valign, halign)
 
         # Create Surface object and fill it with the given background
-        surface = pygame.Surface(self.size)
+        surface = pygame.Surface((width, text_height + 2))
         surface.fill(background)
 
         # Blit one line after another
         accumulated_height = 0
-        for line in text:
-            maintext = font.render(line, 1, color)
-            shadow = font.render(line, 1, outline)
+        for line, (maintext, shadow) in zip(text, lines):
             if halign == 0:  # left aligned
-                hoffset = 0
+                hoffset = 1
             elif halign == 1:  # centered
-                hoffset = (self.size[0] - maintext.get_width()) / 2
-            elif halign == 2:  # right aligned
-                hoffset = rect.width - maintext.get_width()
-            else:
-                #TODO: where the f*ck does justification come from?
-                raise GuiException("Invalid halign argument: " +
-                                   str(justification))
-            pos = (hoffset, voffset + accumulated_height)
+                hoffset = (width - maintext.get_width()) // 2
+            else:  # right aligned
+                hoffset = width - 1 - maintext.get_width()
+            pos = (hoffset, 1 + accumulated_height)
             # Outline
             surface.blit(shadow, (pos[0] - 1, pos[1] - 1))
             surface.blit(shadow, (pos[0] - 1, pos[1] + 1))
@@ -198,57 +458,93 @@ class GUIModule:
             surface.set_colorkey(background)
 
         # Return the rendered surface
-        return surface
+        return surface, offset
+
+    def align(self, size, valign, halign):
+        """Position of a surface of the given size on the screen"""
+        # Determine vertical position
+        if valign == 0:  # top aligned
+            voffset = 0
+        elif valign == 1:  # centered
+            voffset = (self.size[1] - size[1]) // 2
+        elif valign == 2:  # bottom aligned
+            voffset = self.size[1] - size[1]
+        else:
+            raise GuiException("Invalid valign argument: " + str(valign))
+        # Determine horizontal position
+        if halign == 0:  # left aligned
+            hoffset = 0
+        elif halign == 1:  # centered
+            hoffset = (self.size[0] - size[0]) // 2
+        elif halign == 2:  # right aligned
+            hoffset = self.size[0] - size[0]
+        else:
+            raise GuiException("Invalid halign argument: " + str(halign))
+        return (hoffset, voffset)
 
     def teardown(self):
         """Exit function"""
+        log.debug('Picture cache statistics: %s', self.cache.stats())
+        log.debug('Rendering statistics: %s', self.stats())
+        FONTS.clear()
         pygame.quit()
 
 
+def merge_rects(rects):
+    """Drop the rectangles contained in another one and the empty ones"""
+    merged = []
+    for rect in sorted(rects, key=lambda r: -r.width * r.height):
+        if rect.width and rect.height and \
+                not any(other.contains(rect) for other in merged):
+            merged.append(rect)
+    return merged
+
+
+def trim_word(word, font, max_width):
+    """Longest prefix of word narrower than max_width, and its width"""
+    width = font.size(word)[0]
+    if width < max_width:
+        return word, width
+    # binary search on the prefix length
+    low, high = 0, len(word)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if font.size(word[:middle])[0] < max_width:
+            low = middle
+        else:
+            high = middle - 1
+    return word[:low], font.size(word[:low])[0]
+
+
 def wrap_text(msg, font, size):
-    """Wrapping text around the screen"""
+    """Wrapping text around the screen, each word is measured once"""
     final_lines = []  # resulting wrapped text
     requested_lines = msg.splitlines()  # wrap input along line breaks
     accumulated_height = 0  # accumulated height
+    space_width, line_height = font.size(' ')
 
     # Form a series of lines
     for requested_line in requested_lines:
-        # Handle too long lines
-        if font.size(requested_line)[0] > size[0]:
-            # Split at white spaces
-            words = requested_line.split(' ')
-            # if any of our words are too long to fit, trim them
-            for word in words:
-                while font.size(word)[0] >= size[0]:
-                    word = word[:-1]
-            # Start a new line
-            accumulated_line = ""
-            # Put words on the line as long as they fit
-            for word in words:
-                test_line = accumulated_line + word + " "
-                # Build the line while the words fit.
-                if font.size(test_line)[0] < size[0]:
-                    accumulated_line = test_line
-                else:
-                    # Start a new line
-                    line_height = font.size(accumulated_line)[1]
-                    if accumulated_height + line_height > size[1]:
-                        break
-                    else:
-                        accumulated_height += line_height
-                        final_lines.append(accumulated_line)
-                        accumulated_line = word + " "
-            # Finish requested_line
-            line_height = font.size(accumulated_line)[1]
-            if accumulated_height + line_height > size[1]:
-                break
-            else:
+        # Split at white spaces, trimming the words too long to fit
+        words = [trim_word(word, font, size[0])
+                 for word in requested_line.split(' ')]
+        # Put words on the line as long as they fit
+        line, line_width = [], 0
+        for word, width in words:
+            if line and line_width + width >= size[0]:
+                # Start a new line
+                if accumulated_height + line_height > size[1]:
+                    break
                 accumulated_height += line_height
-                final_lines.append(accumulated_line)
-        # Line fits as it is
-        else:
-            accumulated_height += font.size(requested_line)[1]
-            final_lines.append(requested_line)
+                final_lines.append(' '.join(line))
+                line, line_width = [], 0
+            line.append(word)
+            line_width += width + space_width
+        # Finish requested_line
+        if accumulated_height + line_height > size[1]:
+            break
+        accumulated_height += line_height
+        final_lines.append(' '.join(line))
 
     # Check height of wrapped text
     if accumulated_height >= size[1]:
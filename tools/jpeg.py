@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Utils: reading of the JPEG file structure without decoding the picture
+"""
+
+import struct
+
+SOI = b'\xff\xd8'
+# TIFF tags of the EXIF thumbnail (IFD1)
+TAG_THUMBNAIL_OFFSET = 0x0201
+TAG_THUMBNAIL_LENGTH = 0x0202
+# MPF (multi-picture format) tags, used by many reflexes for large previews
+TAG_MP_ENTRY = 0xb002
+
+
+def iter_segments(data):
+    """ Yield (marker, payload start, payload end) for each header segment,
+    the payload may end after the end of data if data is truncated """
+    if data[:2] != SOI:
+        return
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xff:
+            return
+        marker = data[pos + 1]
+        # padding bytes
+        if marker == 0xff:
+            pos += 1
+            continue
+        # markers without payload
+        if marker == 0x01 or 0xd0 <= marker <= 0xd7:
+            pos += 2
+            continue
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        yield marker, pos + 4, pos + 2 + length
+        # start of scan: the compressed data follows
+        if marker == 0xda:
+            return
+        pos += 2 + length
+
+
+def _read_ifd(tiff, offset, order):
+    """ Read a TIFF IFD, return ({tag: (type, count, value or offset)}, next IFD) """
+    count = struct.unpack(order + 'H', tiff[offset:offset + 2])[0]
+    entries = {}
+    for i in range(count):
+        start = offset + 2 + 12 * i
+        tag, kind, number = struct.unpack(order + 'HHI', tiff[start:start + 8])
+        if kind == 3 and number == 1:  # SHORT
+            value = struct.unpack(order + 'H', tiff[start + 8:start + 10])[0]
+        else:
+            value = struct.unpack(order + 'I', tiff[start + 8:start + 12])[0]
+        entries[tag] = (kind, number, value)
+    end = offset + 2 + 12 * count
+    next_ifd = struct.unpack(order + 'I', tiff[end:end + 4])[0]
+    return entries, next_ifd
+
+
+def _tiff_order(tiff):
+    """ struct byte order of a TIFF header """
+    if tiff[:4] == b'II*\x00':
+        return '<'
+    if tiff[:4] == b'MM\x00*':
+        return '>'
+    raise ValueError('Invalid TIFF header')
+
+
+def _exif_thumbnail(tiff):
+    """ JPEG thumbnail referenced by the IFD1 of an EXIF block """
+    order = _tiff_order(tiff)
+    ifd0 = struct.unpack(order + 'I', tiff[4:8])[0]
+    _, ifd1 = _read_ifd(tiff, ifd0, order)
+    if not ifd1:
+        return None
+    entries, _ = _read_ifd(tiff, ifd1, order)
+    if TAG_THUMBNAIL_OFFSET not in entries or TAG_THUMBNAIL_LENGTH not in entries:
+        return None
+    offset = entries[TAG_THUMBNAIL_OFFSET][2]
+    length = entries[TAG_THUMBNAIL_LENGTH][2]
+    return tiff[offset:offset + length]
+
+
+def _mpf_previews(data, mpf_start, mpf):
+    """ Secondary pictures of a MPF block (their offsets are relative to it) """
+    order = _tiff_order(mpf)
+    entries, _ = _read_ifd(mpf, struct.unpack(order + 'I', mpf[4:8])[0], order)
+    if TAG_MP_ENTRY not in entries:
+        return []
+    _, size, offset = entries[TAG_MP_ENTRY]
+    previews = []
+    # 16 bytes per picture, the first one is the main picture itself
+    for start in range(offset + 16, offset + size, 16):
+        length, picture_offset = struct.unpack(order + 'II', mpf[start + 4:start + 12])
+        if picture_offset:
+            begin = mpf_start + picture_offset
+            previews.append(data[begin:begin + length])
+    return previews
+
+
+def extract_embedded_preview(data):
+    """
+    Return the largest JPEG preview embedded in the header of a JPEG file
+    (EXIF thumbnail or MPF preview), or None if there is none
+
+    Only the file bytes are read, the picture is never decoded
+    """
+    data = memoryview(data)
+    candidates = []
+    for marker, start, end in iter_segments(data):
+        payload = data[start:end]
+        try:
+            if marker == 0xe1 and payload[:6] == b'Exif\x00\x00':
+                candidates.append(_exif_thumbnail(payload[6:]))
+            elif marker == 0xe2 and payload[:4] == b'MPF\x00':
+                candidates.extend(_mpf_previews(data, start + 4, payload[4:]))
+        except (ValueError, struct.error):
+            continue
+    candidates = [bytes(c) for c in candidates if c is not None and c[:2] == SOI]
+    if not candidates:
+        return None
+    return max(candidates, key=len)
+
+
+def read_dimensions(path, max_header=256 * 1024):
+    """
+    Return the (width, height) of a JPEG or PNG file read from its header,
+    or None if it cannot be found
+    """
+    with open(path, 'rb') as picture:
+        data = picture.read(max_header)
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR':
+        return struct.unpack('>II', data[16:24])
+    for marker, start, end in iter_segments(data):
+        # start of frame markers (0xc4, 0xc8 and 0xcc are not frames)
+        if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+            if end > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[start + 1:start + 5])
+            return width, height
+    return None
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Live view: low resolution frames of the camera shown during the countdown
+"""
+
+import threading
+from time import monotonic, thread_time
+
+from .photo_log import PHOTO_LOG as log
+
+
+class FrameMailbox:
+    """
+    Hand-off of the latest frame between one producer and one consumer
+
+    Three buffers allocated once are used in turn: the one being written,
+    the latest frame and the one being read. write() never blocks, a frame
+    not read yet is replaced (and counted as dropped) by the next one.
+    """
+
+    def __init__(self, capacity=256 * 1024):
+        self._buffers = [bytearray(capacity) for _ in range(3)]
+        self._lengths = [0] * 3
+        self._latest = None
+        self._reading = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self.written = 0
+        self.dropped = 0
+
+    def write(self, data):
+        """ Copy a frame into a free buffer and make it the latest one """
+        with self._condition:
+            index = next(i for i in range(3) if i not in (self._latest, self._reading))
+        buffer = self._buffers[index]
+        size = len(data)
+        if size > len(buffer):
+            # grows once for larger frames
+            buffer.extend(bytes(size - len(buffer)))
+        buffer[:size] = data
+        with self._condition:
+            if self._latest is not None:
+                self.dropped += 1
+            self._latest = index
+            self._lengths[index] = size
+            self.written += 1
+            self._condition.notify()
+
+    def read(self, timeout=None):
+        """ Wait for a frame newer than the last one read and return it (a
+        memoryview valid until the next read() or release()), None if
+        there is none after timeout seconds or the mailbox is closed """
+        with self._condition:
+            self._reading = None
+            if self._latest is None and not self._closed:
+                self._condition.wait(timeout)
+            if self._latest is None:
+                return None
+            self._reading, self._latest = self._latest, None
+            return memoryview(self._buffers[self._reading])[:self._lengths[self._reading]]
+
+    def release(self):
+        """ The frame returned by read() is no longer used """
+        with self._condition:
+            self._reading = None
+
+    def closed(self):
+        """ Whether close() was called """
+        return self._closed
+
+    def close(self):
+        """ Wake up the reader for good """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+
+class LiveView:
+    """
+    Live view of a camera
+
+    A thread calls grab() (which returns a JPEG frame or None) at most fps
+    times per second and writes the frames into a FrameMailbox, another
+    thread hands the latest frame to consumer(frame). A slow consumer only
+    makes frames dropped; a failing grab() or consumer() only loses its
+    frame (the failures are counted). stats() gives the frame rates and the
+    CPU time used by each thread.
+    """
+
+    # seconds between two checks of stop() by the consuming thread
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, grab, consumer, fps=15):
+        self.grab = grab
+        self.consumer = consumer
+        self.fps = fps
+        self.mailbox = FrameMailbox()
+        self.consumed = 0
+        self.errors = 0
+        self.grab_cpu = 0.
+        self.consume_cpu = 0.
+        self._start = None
+        self._end = None
+        self._stopping = threading.Event()
+        self._threads = [threading.Thread(target=self._produce),
+                         threading.Thread(target=self._consume)]
+        for thread in self._threads:
+            thread.daemon = True
+
+    def start(self):
+        """ Start the live view """
+        self._start = monotonic()
+        for thread in self._threads:
+            thread.start()
+
+    def _produce(self):
+        """ Grabbing thread """
+        start_cpu = thread_time()
+        period = 1. / self.fps
+        deadline = monotonic()
+        try:
+            while not self._stopping.is_set():
+                try:
+                    frame = self.grab()
+                except Exception as err:  # e.g. the camera is busy or gone
+                    self._failed('grab', err)
+                    frame = None
+                if frame is not None:
+                    self.mailbox.write(frame)
+                deadline += period
+                delay = deadline - monotonic()
+                if delay > 0:
+                    self._stopping.wait(delay)
+                else:
+                    # late: no burst to catch up
+                    deadline = monotonic()
+        finally:
+            self.grab_cpu = thread_time() - start_cpu
+            # the consuming thread must never wait for a frame for good
+            self.mailbox.close()
+
+    def _consume(self):
+        """ Consuming thread """
+        start_cpu = thread_time()
+        while True:
+            frame = self.mailbox.read(self.POLL_INTERVAL)
+            if frame is None:
+                if self.mailbox.closed() or self._stopping.is_set():
+                    break
+                continue
+            try:
+                self.consumer(frame)
+                self.consumed += 1
+            except Exception as err:  # e.g. the remote is unreachable
+                self._failed('consumer', err)
+        self.mailbox.release()
+        self.consume_cpu = thread_time() - start_cpu
+
+    def _failed(self, what, err):
+        """ Count a failure, only the first one is logged as an error """
+        self.errors += 1
+        if self.errors == 1:
+            log.error('Live view %s failed: %s', what, err)
+        else:
+            log.debug('Live view %s failed: %s', what, err)
+
+    def stop(self):
+        """ Stop the live view (before the real capture) """
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join()
+        self._end = monotonic()
+
+    def stats(self):
+        """ Frame rates and CPU usage (in percent of one core) """
+        elapsed = max((self._end or monotonic()) - (self._start or monotonic()), 1e-6)
+        return {
+            'fps': self.mailbox.written / elapsed,
+            'consumed_fps': self.consumed / elapsed,
+            'dropped': self.mailbox.dropped,
+            'errors': self.errors,
+            'grab_cpu': 100 * self.grab_cpu / elapsed,
+            'consume_cpu': 100 * self.consume_cpu / elapsed
+        }
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Utils: persistent index of the pictures of a directory tree
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+from .jpeg import read_dimensions
+from .remote_log import REMOTE_LOG as log
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif')
+# the indexes are kept on the local disk: the pictures directory may be a
+# network share, where the SQLite locking cannot be trusted
+INDEX_DIRECTORY = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'photobooth')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime INTEGER
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT,
+    mtime INTEGER,
+    size INTEGER,
+    width INTEGER,
+    height INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE TABLE IF NOT EXISTS settings (
+    name TEXT PRIMARY KEY,
+    value INTEGER
+);
+"""
+
+
+def is_picture(name):
+    """ Whether a file name looks like a picture we can display """
+    return not name.startswith('.') and name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def default_index_path(root, recursive=True):
+    """ Path of the index of a directory in the local cache directory (one
+    index per directory and per recursive mode) """
+    key = '%s\0%d' % (os.path.abspath(root), bool(recursive))
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(INDEX_DIRECTORY, 'index-%s.sqlite' % digest)
+
+
+class PictureIndex:
+    """
+    Index of the pictures (path, mtime, size and dimensions) of a directory,
+    stored in a SQLite file (by default in the local cache directory, see
+    default_index_path())
+
+    update() only lists again the directories whose modification time
+    changed since the last run and only reads the header of the new or
+    modified files.
+    """
+
+    def __init__(self, root, recursive=True, index_path=None):
+        self.root = os.path.abspath(root)
+        self.recursive = recursive
+        if index_path is None:
+            index_path = default_index_path(self.root, recursive)
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+            self._db = sqlite3.connect(index_path, check_same_thread=False)
+            self._db.executescript(SCHEMA)
+        except (sqlite3.Error, OSError) as err:
+            log.warning('Cannot use the index %s (%s), using a memory index',
+                        index_path, err)
+            self._db = sqlite3.connect(':memory:', check_same_thread=False)
+            self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        with self._db:
+            row = self._db.execute(
+                "SELECT value FROM settings WHERE name = 'recursive'").fetchone()
+            if row is not None and row[0] != bool(recursive):
+                # the directories listed in the other mode are all listed again
+                self._db.execute('UPDATE dirs SET mtime = NULL')
+            self._db.execute("INSERT OR REPLACE INTO settings VALUES ('recursive', ?)",
+                             (bool(recursive),))
+
+    def update(self):
+        """ Bring the index up to date with the directory tree """
+        with self._lock, self._db:
+            seen = set()
+            stack = [self.root]
+            while stack:
+                directory = stack.pop()
+                seen.add(directory)
+                stack.extend(self._update_dir(directory))
+            known = [row[0] for row in self._db.execute('SELECT path FROM dirs')]
+            for directory in known:
+                if directory not in seen:
+                    self._forget_dir(directory)
+
+    def _update_dir(self, directory):
+        """ Update the entries of one directory, return its subdirectories """
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return []
+        row = self._db.execute('SELECT mtime FROM dirs WHERE path = ?',
+                               (directory,)).fetchone()
+        if row is not None and row[0] == mtime:
+            # same listing as last time
+            if not self.recursive:
+                return []
+            return [r[0] for r in self._db.execute(
+                'SELECT path FROM dirs WHERE parent = ?', (directory,))]
+        subdirs = []
+        present = set()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if self.recursive and not entry.name.startswith('.'):
+                            subdirs.append(entry.path)
+                    elif entry.is_file() and is_picture(entry.name):
+                        present.add(entry.path)
+                        self._update_file(entry.path, directory, entry.stat())
+                except OSError:
+                    continue
+        for (path,) in self._db.execute('SELECT path FROM files WHERE dir = ?',
+                                        (directory,)).fetchall():
+            if path not in present:
+                self._db.execute('DELETE FROM files WHERE path = ?', (path,))
+        self._db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)',
+                         (directory, os.path.dirname(directory), mtime))
+        return subdirs
+
+    def _update_file(self, path, directory, stat):
+        """ Add or refresh a file, its header is only read when it changed """
+        row = self._db.execute('SELECT mtime, size FROM files WHERE path = ?',
+                               (path,)).fetchone()
+        if row is not None and row == (stat.st_mtime_ns, stat.st_size):
+            return
+        try:
+            dimensions = read_dimensions(path) or (None, None)
+        except OSError:
+            dimensions = (None, None)
+        self._db.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                         (path, directory, stat.st_mtime_ns, stat.st_size) + tuple(dimensions))
+
+    def _forget_dir(self, directory):
+        """ Remove a directory and its files from the index """
+        self._db.execute('DELETE FROM files WHERE dir = ?', (directory,))
+        self._db.execute('DELETE FROM dirs WHERE path = ?', (directory,))
+
+    def pictures(self, directory=None):
+        """ Sorted list of the indexed pictures (of one directory only if
+        directory is given) """
+        with self._lock:
+            if directory is None:
+                rows = self._db.execute('SELECT path FROM files ORDER BY path')
+            else:
+                rows = self._db.execute(
+                    'SELECT path FROM files WHERE dir = ? ORDER BY path',
+                    (os.path.abspath(directory),))
+            return [row[0] for row in rows]
+
+    def info(self, path):
+        """ (mtime, size, width, height) of an indexed picture, or None """
+        with self._lock:
+            return self._db.execute(
+                'SELECT mtime, size, width, height FROM files WHERE path = ?',
+                (path,)).fetchone()
+
+    def close(self):
+        """ Close the index """
+        with self._lock:
+            self._db.close()
@@ -3,9 +3,10 @@
 Utils: list of pictures
 """
 
-from glob import glob
 import os
 
+from .picture_index import PictureIndex
+
 class PictureList:
     """
     Class used to construct a list of pictures
@@ -30,7 +31,11 @@ class PictureList:
 
     def find_pictures(self):
         """ Find pictures """
-        return glob(self.path + "*" + self.suffix)
+        index = PictureIndex(self.path, recursive=False)
+        index.update()
+        pictures = [p for p in index.pictures() if p.endswith(self.suffix)]
+        index.close()
+        return pictures
 
     def get_pictures_list(self):
         """ Get the sorted list of picture """
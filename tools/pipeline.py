@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Hand-off between the picture taking and the compressing process
+"""
+
+from multiprocessing import Queue, Value
+from time import time
+
+
+class PictureQueue:
+    """
+    Process-safe queue of new pictures, with metrics on its depth and on the
+    time spent by the pictures in the queue
+    """
+
+    # sentinel asking the consumer to stop
+    STOP = None
+
+    def __init__(self):
+        self._queue = Queue()
+        self._depth = Value('i', 0)
+        # consumer-side metrics
+        self.count = 0
+        self.total_wait = 0.
+        self.max_wait = 0.
+        self.last_wait = 0.
+
+    def put(self, item):
+        """ Add an item at the end of the queue """
+        with self._depth.get_lock():
+            self._depth.value += 1
+        self._queue.put((item, time()))
+
+    def get(self):
+        """ Block until an item is available and return it """
+        item, put_time = self._queue.get()
+        with self._depth.get_lock():
+            self._depth.value -= 1
+        if item is not self.STOP:
+            self.last_wait = time() - put_time
+            self.count += 1
+            self.total_wait += self.last_wait
+            self.max_wait = max(self.max_wait, self.last_wait)
+        return item
+
+    def stop(self):
+        """ Ask the consumer to stop once the pending items are processed """
+        self.put(self.STOP)
+
+    def depth(self):
+        """ Number of items waiting in the queue """
+        return self._depth.value
+
+    def stats(self):
+        """ Consumer-side metrics (times in seconds) """
+        return {
+            'count': self.count,
+            'depth': self.depth(),
+            'last_wait': self.last_wait,
+            'mean_wait': self.total_wait / self.count if self.count else 0.,
+            'max_wait': self.max_wait
+        }
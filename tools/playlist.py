@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Utils: sorted list of pictures with a cursor
+"""
+
+from bisect import bisect_left, insort
+import os
+import sys
+
+
+class Playlist:
+    """
+    Sorted list of picture paths supporting indexed access, insertion and
+    deletion in logarithmic time, with a cursor (the index of the next
+    picture to show) that keeps pointing at the same picture when pictures
+    are inserted or removed before it
+
+    The paths are stored as (directory, name) tuples in blocks of at most
+    2 * LOAD entries, the directories are interned so that all the pictures
+    of a folder share one string. A Fenwick tree over the block lengths maps
+    a position to its block.
+    """
+
+    LOAD = 256
+
+    def __init__(self, paths=()):
+        keys = sorted(set(self._key(path) for path in paths))
+        self._blocks = [keys[i:i + self.LOAD] for i in range(0, len(keys), self.LOAD)]
+        self._maxes = [block[-1] for block in self._blocks]
+        self._len = len(keys)
+        self._build_tree()
+        self.cursor = 0
+
+    @staticmethod
+    def _key(path):
+        """ Sort key and storage of a path """
+        directory, name = os.path.split(path)
+        return (sys.intern(directory), name)
+
+    @staticmethod
+    def _path(key):
+        """ Path of a stored key """
+        return os.path.join(key[0], key[1])
+
+    def _build_tree(self):
+        """ Rebuild the Fenwick tree of the block lengths """
+        tree = [0] * (len(self._blocks) + 1)
+        for i, block in enumerate(self._blocks, 1):
+            tree[i] += len(block)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, block_index, delta):
+        """ Add delta to the length of a block in the tree """
+        i = block_index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _offset(self, block_index):
+        """ Number of entries before a block """
+        total = 0
+        i = block_index
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, index):
+        """ (block index, position in the block) of a position """
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('Playlist index out of range')
+        block_index = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = block_index + step
+            if nxt < len(self._tree) and self._tree[nxt] <= index:
+                block_index = nxt
+                index -= self._tree[nxt]
+            step >>= 1
+        return block_index, index
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index):
+        block_index, pos = self._locate(index)
+        return self._path(self._blocks[block_index][pos])
+
+    def __delitem__(self, index):
+        self.remove(index)
+
+    def __iter__(self):
+        for block in self._blocks:
+            for key in block:
+                yield self._path(key)
+
+    def __contains__(self, path):
+        return self.index(path) >= 0
+
+    def index(self, path):
+        """ Position of a path, -1 if it is not in the playlist """
+        key = self._key(path)
+        block_index = bisect_left(self._maxes, key)
+        if block_index == len(self._blocks):
+            return -1
+        block = self._blocks[block_index]
+        pos = bisect_left(block, key)
+        if pos < len(block) and block[pos] == key:
+            return self._offset(block_index) + pos
+        return -1
+
+    def add(self, path):
+        """ Insert a path at its place and return its position (a path
+        already in the playlist is not added twice) """
+        existing = self.index(path)
+        if existing >= 0:
+            return existing
+        key = self._key(path)
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+            self._build_tree()
+            block_index = 0
+        else:
+            block_index = min(bisect_left(self._maxes, key), len(self._blocks) - 1)
+            block = self._blocks[block_index]
+            insort(block, key)
+            self._maxes[block_index] = block[-1]
+            self._tree_add(block_index, 1)
+        self._len += 1
+        index = self.index(path)
+        if len(self._blocks[block_index]) > 2 * self.LOAD:
+            self._split(block_index)
+        if index <= self.cursor:
+            self.cursor += 1
+        return index
+
+    def _split(self, block_index):
+        """ Split a block that grew too large """
+        block = self._blocks[block_index]
+        self._blocks[block_index:block_index + 1] = [block[:self.LOAD], block[self.LOAD:]]
+        self._maxes[block_index:block_index + 1] = [block[self.LOAD - 1], block[-1]]
+        self._build_tree()
+
+    def remove(self, index):
+        """ Remove the path at a position and return it """
+        if index < 0:
+            index += self._len
+        block_index, pos = self._locate(index)
+        block = self._blocks[block_index]
+        key = block.pop(pos)
+        if block:
+            self._maxes[block_index] = block[-1]
+            self._tree_add(block_index, -1)
+        else:
+            del self._blocks[block_index]
+            del self._maxes[block_index]
+            self._build_tree()
+        self._len -= 1
+        if index < self.cursor:
+            self.cursor -= 1
+        return self._path(key)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Background loading of the next pictures of the slideshow
+"""
+
+import threading
+
+from .gui import GuiException
+from .remote_log import REMOTE_LOG as log
+
+
+class Prefetcher:
+    """
+    Thread decoding and scaling the pictures the slideshow will show next,
+    so that they are already in the cache of the display when needed
+    """
+
+    def __init__(self, display):
+        self.display = display
+        self._wanted = []
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def request(self, filenames):
+        """ Replace the pictures to load, the most urgent first """
+        with self._condition:
+            self._wanted = list(filenames)
+            self._condition.notify()
+
+    def _run(self):
+        """ Prefetching thread """
+        while True:
+            with self._condition:
+                while not self._wanted and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                filename = self._wanted.pop(0)
+            try:
+                self.display.preload_picture(filename)
+            except GuiException as exc:
+                log.debug('Cannot prefetch %s: %s', filename, exc)
+
+    def stop(self):
+        """ Stop the thread """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
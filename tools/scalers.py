@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Scaler backends: decoding of a picture into a display-ready surface that
+fits into a given size
+"""
+
+import pygame
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    from PIL import Image
+    from .thumbnails import open_reduced
+except ImportError:
+    Image = None
+
+
+def scaled_size(image_size, size):
+    """ Size of a picture scaled down to fit into size (never scaled up) """
+    image_scale = min([min(a, b) / b for a, b in zip(size, image_size)])
+    return [max(1, int(a * image_scale)) for a in image_size]
+
+
+def _load(filename):
+    """ Decode a picture and convert it to the display format """
+    return pygame.image.load(filename).convert()
+
+
+def scale_nearest(filename, size):
+    """ pygame.transform.scale: fastest, nearest neighbour """
+    image = _load(filename)
+    return pygame.transform.scale(image, scaled_size(image.get_size(), size))
+
+
+def scale_smooth(filename, size):
+    """ pygame.transform.smoothscale: bilinear/box filter, with the MMX or
+    SSE code when pygame was built with it """
+    image = _load(filename)
+    return pygame.transform.smoothscale(image, scaled_size(image.get_size(), size))
+
+
+def scale_pillow(filename, size):
+    """ Pillow: JPEG draft decode, integer reduce() then bilinear resize
+    (faster with Pillow-SIMD, which is a drop-in replacement) """
+    image = open_reduced(filename, size)
+    new_size = tuple(scaled_size(image.size, size))
+    factor = min(image.size[0] // new_size[0], image.size[1] // new_size[1])
+    if factor >= 2:
+        image = image.reduce(factor)
+    if image.size != new_size:
+        image = image.resize(new_size, Image.BILINEAR)
+    return pygame.image.frombuffer(image.tobytes(), image.size, 'RGB').convert()
+
+
+def scale_numpy(filename, size):
+    """ NumPy: integer box filter on the pixels in the display format, the
+    remaining (less than 2x) reduction is done by smoothscale """
+    image = _load(filename)
+    new_size = scaled_size(image.get_size(), size)
+    factor = min(image.get_width() // new_size[0], image.get_height() // new_size[1])
+    if factor >= 2:
+        pixels = pygame.surfarray.pixels3d(image)
+        width, height = (pixels.shape[0] // factor, pixels.shape[1] // factor)
+        # sum of the factor x factor blocks, one strided view at a time
+        # (much faster than a reshape of the non-contiguous pixel view)
+        dtype = numpy.uint16 if factor <= 16 else numpy.uint32
+        reduced = numpy.zeros((width, height, 3), dtype)
+        for i in range(factor):
+            for j in range(factor):
+                reduced += pixels[i:width * factor:factor, j:height * factor:factor]
+        reduced //= factor * factor
+        del pixels
+        image = pygame.surfarray.make_surface(reduced.astype(numpy.uint8)).convert()
+    if image.get_size() != tuple(new_size):
+        image = pygame.transform.smoothscale(image, new_size)
+    return image
+
+
+# name: (function, whether its dependencies are installed)
+SCALERS = {
+    'scale': (scale_nearest, True),
+    'smoothscale': (scale_smooth, True),
+    'pillow': (scale_pillow, Image is not None),
+    'numpy': (scale_numpy, numpy is not None)
+}
+
+
+def available_scalers():
+    """ Names of the backends that can be used here """
+    return [name for name, (_, available) in SCALERS.items() if available]
+
+
+def get_scaler(name):
+    """ Function of a backend: scaler(filename, size) returns a surface in the
+    display format (the display must be initialized) """
+    if name not in SCALERS:
+        raise ValueError('Unknown scaler ' + str(name))
+    function, available = SCALERS[name]
+    if not available:
+        raise ValueError('The ' + name + ' scaler needs a module that is not installed')
+    return function
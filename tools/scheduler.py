@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Timers run from a single loop
+"""
+
+import heapq
+import itertools
+from time import monotonic
+
+
+class Scheduler:
+    """
+    Heap of timers run by the thread calling run_pending()
+
+    It is only used from that loop thread, which asks time_to_next() how
+    long it may block on its own events. The callbacks run one after the
+    other, in the order of their deadlines (and of their scheduling for
+    equal deadlines).
+    """
+
+    def __init__(self):
+        self._timers = []
+        self._cancelled = set()
+        self._sequence = itertools.count()
+
+    def call_at(self, deadline, callback, *args):
+        """ Run callback(*args) at a time.monotonic() deadline, return a
+        handle for cancel() """
+        handle = next(self._sequence)
+        heapq.heappush(self._timers, (deadline, handle, callback, args))
+        return handle
+
+    def call_later(self, delay, callback, *args):
+        """ Run callback(*args) in delay seconds """
+        return self.call_at(monotonic() + delay, callback, *args)
+
+    def cancel(self, handle):
+        """ Cancel a timer (no-op if it already ran) """
+        if handle is None:
+            return
+        if any(timer[1] == handle for timer in self._timers):
+            self._cancelled.add(handle)
+
+    def time_to_next(self):
+        """ Seconds before the next deadline, None if there is no timer """
+        self._drop_cancelled()
+        if not self._timers:
+            return None
+        return max(0., self._timers[0][0] - monotonic())
+
+    def _drop_cancelled(self):
+        """ Pop the cancelled timers at the top of the heap """
+        while self._timers and self._timers[0][1] in self._cancelled:
+            self._cancelled.discard(heapq.heappop(self._timers)[1])
+
+    def run_pending(self):
+        """ Run the timers whose deadline passed, return how many ran """
+        now = monotonic()
+        ran = 0
+        while True:
+            self._drop_cancelled()
+            if not self._timers or self._timers[0][0] > now:
+                return ran
+            _, _, callback, args = heapq.heappop(self._timers)
+            callback(*args)
+            ran += 1
+
+    def clear(self):
+        """ Drop every timer """
+        self._timers = []
+        self._cancelled.clear()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Composites of the pictures of a burst: photo strip or grid
+"""
+
+import io
+import math
+import os
+
+from PIL import Image
+
+from .files import atomic_write
+from .photo_log import PHOTO_LOG as log
+from .thumbnails import make_renditions, make_tile
+
+LAYOUTS = ('strip', 'grid')
+
+
+def layout_cells(count, layout, tile_size, margin):
+    """ Size of the composite and position of each of its count tiles """
+    if layout == 'strip':
+        columns = 1
+    elif layout == 'grid':
+        columns = math.ceil(math.sqrt(count))
+    else:
+        raise ValueError('Unknown layout ' + str(layout))
+    rows = math.ceil(count / columns)
+    size = (columns * (tile_size[0] + margin) + margin,
+            rows * (tile_size[1] + margin) + margin)
+    cells = [(margin + (i % columns) * (tile_size[0] + margin),
+              margin + (i // columns) * (tile_size[1] + margin))
+             for i in range(count)]
+    return size, cells
+
+
+def make_composite(path, tiles, layout, tile_size, margin, renditions, preset,
+                   background=(255, 255, 255)):
+    """
+    Paste the tiles (images made by make_tile(), None for a missing picture)
+    into a composite saved under path, then create its renditions like
+    make_renditions() does; runs on a worker of the thumbnail pool
+    """
+    size, cells = layout_cells(len(tiles), layout, tile_size, margin)
+    image = Image.new('RGB', size, background)
+    for index, tile in enumerate(tiles):
+        if tile is None:
+            continue
+        # centered into its cell
+        x, y = cells[index]
+        image.paste(tile, (x + (tile_size[0] - tile.size[0]) // 2,
+                           y + (tile_size[1] - tile.size[1]) // 2))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=95)
+    data = buffer.getvalue()
+    try:
+        atomic_write(path, data)
+    except OSError as err:
+        log.error('Cannot save the composite %s: %s', path, err)
+    basename = os.path.splitext(os.path.basename(path))[0] + ".jpg"
+    return make_renditions(data, basename, renditions, preset)
+
+
+class StripComposer:
+    """
+    Composite of the count pictures of a burst
+
+    Each picture given to add() (in the thread of the compressing process)
+    is decoded at a reduced scale by a job of the ThumbnailEngine right
+    away, so the tiles of a burst are made in parallel while it is taken.
+    Once every picture arrived (or finish() is called), the tiles are
+    collected and a last job composes and saves them under path and creates
+    the renditions of the composite, then on_done(renditions) is called
+    like for a picture.
+    """
+
+    def __init__(self, engine, path, count, layout, tile_size, on_done,
+                 margin=20):
+        self.engine = engine
+        self.path = path
+        self.count = count
+        self.layout = layout
+        self.tile_size = tile_size
+        self.on_done = on_done
+        self.margin = margin
+        # AsyncResult of the tile of each picture, None if it is missing
+        self._tiles = [None] * count
+        self._arrived = 0
+        self._submitted = False
+
+    def add(self, index, data):
+        """ Add picture number index (from 0): its JPEG data or its path,
+        None if it could not be taken """
+        if data is None:
+            log.warning('Picture %d of %s is missing', index, self.path)
+        else:
+            self._tiles[index] = self.engine.submit_job(
+                make_tile, (data, self.tile_size, self.engine.preset))
+        self._arrived += 1
+        if self._arrived >= self.count:
+            self.finish()
+
+    def done(self):
+        """ Whether the composite was handed to the engine """
+        return self._submitted
+
+    def _collect(self):
+        """ Wait for the tiles in flight, return the images """
+        tiles = []
+        for index, result in enumerate(self._tiles):
+            tile = None
+            if result is not None:
+                try:
+                    tile = result.get()
+                except Exception as err:  # raised by the job, e.g. a bad picture
+                    log.error('Cannot add picture %d to %s: %s', index, self.path, err)
+            tiles.append(tile)
+        return tiles
+
+    def finish(self):
+        """ Compose the pictures arrived so far (the others will not come) """
+        if self._submitted:
+            return
+        if self._arrived < self.count:
+            log.warning('%s is composed without %d of its pictures', self.path,
+                        self.count - self._arrived)
+        self._submitted = True
+        tiles = self._collect()
+        self._tiles = None
+
+        def error(err):
+            log.error('Cannot compose %s: %s', self.path, err)
+        self.engine.submit_job(
+            make_composite,
+            (self.path, tiles, self.layout, self.tile_size, self.margin,
+             self.engine.renditions, self.engine.preset),
+            self.on_done, error)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+LRU cache of decoded and scaled pictures
+"""
+
+from collections import OrderedDict
+import threading
+
+
+class SurfaceCache:
+    """
+    LRU cache of display-ready surfaces with a memory budget
+
+    Keys are built by the caller, e.g. (path, mtime, size): a file rewritten
+    with a new modification time is never served from a stale entry
+    """
+
+    def __init__(self, budget_mb):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def surface_bytes(surface):
+        """ Memory used by the pixels of a surface """
+        return surface.get_pitch() * surface.get_height()
+
+    def get(self, key):
+        """ Return the cached surface or None """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, surface):
+        """ Add a surface, evicting the least recently used ones if needed """
+        size = self.surface_bytes(surface)
+        if size > self.budget:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.used -= self._entries.pop(key)[1]
+            self._entries[key] = (surface, size)
+            self.used += size
+            while self.used > self.budget:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.used -= evicted_size
+
+    def clear(self):
+        """ Drop every entry """
+        with self._lock:
+            self._entries.clear()
+            self.used = 0
+
+    def stats(self):
+        """ Counters of the cache """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'used_mb': self.used / 1024 / 1024,
+                'budget_mb': self.budget / 1024 / 1024,
+                'hits': self.hits,
+                'misses': self.misses
+            }
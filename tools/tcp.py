@@ -3,42 +3,192 @@
 Server for picture synchronization
 """
 
-from socketserver import TCPServer, BaseRequestHandler
+import asyncio
+import hashlib
+import os
 
+from .files import atomic_write
 from .remote_log import REMOTE_LOG as log
 
+MAX_FILE_SIZE = 32 * 1024 * 1024  # bytes, a screen rendition is far smaller
+MAX_FRAME_SIZE = 4 * 1024 * 1024  # bytes, a live view frame is far smaller
 
-class PhotoTCPHandler(BaseRequestHandler):
+
+class PhotoServer:
     """
-    The request handler class for our server.
+    Class that represents our TCP server
 
-    It is instantiated once per connection to the server, and must
-    override the handle() method to implement communication to the
-    client.
+    It runs an asyncio event loop in the thread calling serve_forever(), so
+    any number of booths or phones can stay connected at the same time and a
+    stalled client never blocks the others. The clients send one name per
+    line, possibly several lines per write; a "PUT <size> <sha256> <name>"
+    line is followed by the content of the file, a "LIVE <size>" line by a
+    live view frame. The names are put into queue (a queue.Queue shared with
+    the display loop), the frames are given to on_frame(data)
     """
 
-    def handle(self):
-        # self.request is the TCP socket connected to the client
-        self.data = self.request.recv(1024).strip()
-        try:
-            self.server.put(
-                self.data.decode(encoding="utf-8", errors="strict"))
-        except UnicodeError:
-            pass
+    def __init__(self, address, port, queue, directory=None,
+                 idle_timeout=600., transfer_timeout=30., on_frame=None,
+                 max_file_size=MAX_FILE_SIZE, max_frame_size=MAX_FRAME_SIZE):
+        self.address = address
+        self.port = port
+        self._queue = queue
+        # where the live view frames go, None to ignore them
+        self.on_frame = on_frame
+        # where the received files are written, None to refuse them
+        self.directory = directory
+        # a connection sending nothing for idle_timeout seconds is closed
+        self.idle_timeout = idle_timeout
+        # maximum time to receive the content of one file
+        self.transfer_timeout = transfer_timeout
+        # larger files and frames are refused before anything is read
+        self.max_file_size = max_file_size
+        self.max_frame_size = max_frame_size
+        self._loop = None
+        self._stop = None
+        # shutdown() may be called before the loop is running
+        self._stopping = False
+        self._connections = {}
 
+    def serve_forever(self):
+        """ Serve the clients until shutdown() is called """
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            self._loop.close()
 
-class PhotoServer(TCPServer):
-    """ Class that represents our TCP server"""
+    def shutdown(self):
+        """ Stop serve_forever(), can be called from any thread, even before
+        serve_forever() """
+        self._stopping = True
+        if self._loop is not None and self._stop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._stop.set)
+            except RuntimeError:
+                # the loop is already closed
+                pass
 
-    def __init__(self, address, port, queue):
-        self._queue = queue
+    async def _serve(self):
+        """ Main coroutine of the server """
+        self._stop = asyncio.Event()
+        if self._stopping:
+            return
         log.debug(
             'Binding the listening socket to address %(address)s and port %(port)s',
-            {'address': address,
-             'port': port})
-        super(PhotoServer, self).__init__((address, port), PhotoTCPHandler)
+            {'address': self.address,
+             'port': self.port})
+        server = await asyncio.start_server(self._handle, self.address,
+                                            self.port, reuse_address=True)
+        await self._stop.wait()
+        server.close()
+        await server.wait_closed()
+        # drop the clients still connected
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+    async def _handle(self, reader, writer):
+        """ Handle one client connection """
+        peer = writer.get_extra_info('peername')
+        log.debug('New connection from %s', peer)
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                if not line:
+                    break
+                try:
+                    data = line.decode(encoding="utf-8", errors="strict").strip()
+                except UnicodeError:
+                    continue
+                if data.startswith("PUT "):
+                    if not await self._receive_file(reader, data):
+                        break
+                elif data.startswith("LIVE "):
+                    if not await self._receive_frame(reader, data):
+                        break
+                elif data:
+                    self.put(data)
+        except asyncio.TimeoutError:
+            log.debug('Connection from %s timed out', peer)
+        except (ConnectionError, ValueError) as err:
+            log.debug('Connection from %s failed: %s', peer, err)
+        finally:
+            writer.close()
+            self._connections.pop(task, None)
+        log.debug('Connection from %s closed', peer)
+
+    async def _receive_file(self, reader, header):
+        """ Receive the file announced by header, return False if the
+        connection is no longer usable """
+        try:
+            _, size, checksum, name = header.split(" ", 3)
+            size = int(size)
+        except ValueError:
+            log.error('Invalid file header: %s', header)
+            return False
+        if not 0 <= size <= self.max_file_size:
+            # the content cannot be skipped safely, the connection is dropped
+            log.error('Refusing %s: invalid size %d (maximum %d bytes)',
+                      name, size, self.max_file_size)
+            return False
+        try:
+            content = await asyncio.wait_for(reader.readexactly(size),
+                                             self.transfer_timeout)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            log.error('Connection lost while receiving %s', name)
+            return False
+        if hashlib.sha256(content).hexdigest() != checksum:
+            log.error('Wrong checksum for %s, file discarded', name)
+            return True
+        # the disk write must not block the other connections
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.store, name, content)
+        except OSError as err:
+            log.error('Cannot write the received file %s: %s', name, err)
+        return True
+
+    async def _receive_frame(self, reader, header):
+        """ Receive a live view frame, return False if the connection is no
+        longer usable """
+        try:
+            size = int(header.split(" ", 1)[1])
+        except ValueError:
+            log.error('Invalid frame header: %s', header)
+            return False
+        if not 0 <= size <= self.max_frame_size:
+            # the content cannot be skipped safely, the connection is dropped
+            log.error('Refusing a live frame: invalid size %d (maximum %d bytes)',
+                      size, self.max_frame_size)
+            return False
+        try:
+            content = await asyncio.wait_for(reader.readexactly(size),
+                                             self.transfer_timeout)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            log.error('Connection lost while receiving a live frame')
+            return False
+        if self.on_frame is not None:
+            self.on_frame(content)
+        return True
 
     def put(self, data):
         """ Method used to put data into the queue """
         log.debug('Received the following data from the network: %s', data)
         self._queue.put(data)
+
+    def store(self, name, content):
+        """ Atomically write a received file, then put its name into the queue """
+        if self.directory is None:
+            log.error('Received file %s but the transfer is disabled', name)
+            return
+        directory = os.path.abspath(self.directory)
+        path = os.path.abspath(os.path.join(directory, name))
+        if os.path.commonpath([directory, path]) != directory:
+            log.error('Refusing to write %s outside of %s', name, directory)
+            return
+        atomic_write(path, content)
+        log.debug('Received file %s (%d bytes)', name, len(content))
+        self.put(name)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Client announcing the new pictures to the remote control
+"""
+
+from collections import deque
+import hashlib
+import select
+import socket
+import threading
+
+from .photo_log import PHOTO_LOG as log
+
+
+class PhotoClient:
+    """
+    Long-lived connection to the remote control
+
+    The messages are newline-framed; send() and send_file() only queue them
+    and return, a background thread writes everything pending in a single
+    write and reconnects with an exponential backoff when the connection is
+    lost. Live view frames are never queued: only the latest one not sent
+    yet is kept
+    """
+
+    def __init__(self, host, port, timeout=5., min_backoff=0.5, max_backoff=30.):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._pending = deque()
+        self._frame = None
+        self.dropped_frames = 0
+        self._condition = threading.Condition()
+        self._closing = False
+        self._sock = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def send(self, *messages):
+        """ Queue messages (strings without newline) for the remote """
+        self._queue(*[(message + "\n").encode("utf-8") for message in messages])
+
+    def send_file(self, name, data):
+        """ Queue the content of a file for the remote, which writes it under
+        name (relative to its picture directory) and then announces it """
+        header = "PUT %d %s %s\n" % (len(data), hashlib.sha256(data).hexdigest(), name)
+        self._queue(header.encode("utf-8") + data)
+
+    def send_frame(self, data):
+        """ Send a live view frame (JPEG data), replacing the one not sent yet """
+        frame = b"LIVE %d\n" % len(data) + data
+        with self._condition:
+            if self._frame is not None:
+                self.dropped_frames += 1
+            self._frame = frame
+            self._condition.notify()
+
+    def _queue(self, *frames):
+        """ Queue encoded frames """
+        with self._condition:
+            self._pending.extend(frames)
+            self._condition.notify()
+
+    def _connect(self):
+        """ Open the connection to the remote """
+        log.debug('Connecting to the remote at %s:%s', *self.address)
+        self._sock = socket.create_connection(self.address, self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _peer_closed(self):
+        """ Whether the remote closed the connection (e.g. idle timeout) """
+        # the remote never writes: a readable socket is an EOF or an error
+        readable, _, _ = select.select([self._sock], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return self._sock.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+
+    def _disconnect(self):
+        """ Close the connection to the remote """
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def _run(self):
+        """ Sending thread """
+        backoff = self.min_backoff
+        while True:
+            with self._condition:
+                while not self._pending and self._frame is None and not self._closing:
+                    self._condition.wait()
+                if not self._pending and (self._closing or self._frame is None):
+                    break
+                batch = list(self._pending)
+                frame = self._frame
+            try:
+                if self._sock is not None and self._peer_closed():
+                    self._disconnect()
+                if self._sock is None:
+                    self._connect()
+                self._sock.sendall(b"".join(batch + ([frame] if frame else [])))
+            except OSError as err:
+                log.warning('Cannot reach the remote (%s), retrying in %.1f s',
+                            err, backoff)
+                self._disconnect()
+                with self._condition:
+                    if self._closing:
+                        break
+                    self._condition.wait(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            backoff = self.min_backoff
+            with self._condition:
+                for _ in batch:
+                    self._pending.popleft()
+                if self._frame is frame:
+                    self._frame = None
+        self._disconnect()
+
+    def close(self, timeout=5.):
+        """ Send the pending messages (for at most timeout seconds) and close """
+        with self._condition:
+            self._closing = True
+            self._condition.notify()
+        self._thread.join(timeout)
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+Thumbnail engine: creates the reduced renditions of the new pictures
+"""
+
+import io
+from multiprocessing import Pool, Value
+import os
+
+from PIL import Image
+
+from .files import atomic_write
+from .photo_log import PHOTO_LOG as log
+
+# Quality/speed presets
+# draft_margin: the JPEG decoder scales the picture down by 1/2, 1/4 or 1/8
+# while keeping it at least draft_margin times larger than the largest
+# rendition, the final filter does the rest
+PRESETS = {
+    # best looking renditions, each one resized from the full picture
+    'quality': {
+        'resample': Image.LANCZOS,
+        'draft_margin': 2,
+        'cascade': False,
+        'save': {'quality': 95, 'optimize': True, 'progressive': True}
+    },
+    # each rendition is resized from the previous (larger) one
+    'balanced': {
+        'resample': Image.BICUBIC,
+        'draft_margin': 1,
+        'cascade': True,
+        'save': {'quality': 90, 'progressive': True}
+    },
+    'fast': {
+        'resample': Image.BILINEAR,
+        'draft_margin': 1,
+        'cascade': True,
+        'save': {'quality': 85}
+    }
+}
+
+
+def fit_size(size, box):
+    """ Largest size with the ratio of size that fits into box """
+    scale = min(box[0] / size[0], box[1] / size[1], 1.)
+    return (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+
+
+def open_reduced(source, box, margin=1):
+    """
+    Open source (a path or the JPEG data) and decode it at the smallest DCT
+    scale (1/1, 1/2, 1/4 or 1/8) that stays at least margin times larger than
+    what fits into box
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    image = Image.open(source)
+    target = fit_size(image.size, (box[0] * margin, box[1] * margin))
+    # no-op for the formats other than JPEG
+    image.draft('RGB', target)
+    image.load()
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def make_renditions(source, basename, renditions, preset):
+    """
+    Decode source once and save one JPEG per rendition
+
+    renditions is a list of (name, directory, maximum size) tuples, the
+    function returns a dictionary {name: path of the rendition}
+    """
+    settings = PRESETS[preset]
+    # from the largest to the smallest rendition
+    renditions = sorted(renditions, key=lambda r: -r[2][0] * r[2][1])
+    image = open_reduced(source, renditions[0][2], settings['draft_margin'])
+    paths = {}
+    for name, directory, box in renditions:
+        resized = image.resize(fit_size(image.size, box), settings['resample'])
+        if settings['cascade']:
+            image = resized
+        path = os.path.join(directory, basename)
+        buffer = io.BytesIO()
+        resized.save(buffer, 'JPEG', **settings['save'])
+        atomic_write(path, buffer.getvalue())
+        paths[name] = path
+    return paths
+
+
+def make_tile(source, box, preset):
+    """
+    Decode source at a reduced scale and resize it to fit into box (a tile
+    of a composite), return the image
+    """
+    settings = PRESETS[preset]
+    image = open_reduced(source, box, settings['draft_margin'])
+    return image.resize(fit_size(image.size, box), settings['resample'])
+
+
+def enlarge(source, box, preset):
+    """
+    Scale source (a small JPEG, e.g. the thumbnail of a camera) up to fit
+    into box, return the JPEG data
+    """
+    settings = PRESETS[preset]
+    image = open_reduced(source, box)
+    scale = min(box[0] / image.size[0], box[1] / image.size[1])
+    image = image.resize((max(1, round(image.size[0] * scale)),
+                          max(1, round(image.size[1] * scale))),
+                         settings['resample'])
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', **settings['save'])
+    return buffer.getvalue()
+
+
+class ThumbnailEngine:
+    """
+    Pool of processes creating the renditions of the new pictures
+
+    counter (a multiprocessing.Value, so that another process can read it)
+    holds the number of jobs submitted and not finished yet
+    """
+
+    def __init__(self, renditions, preset='balanced', workers=None, counter=None):
+        if preset not in PRESETS:
+            raise ValueError('Unknown thumbnail preset ' + str(preset))
+        self.renditions = list(renditions)
+        self.preset = preset
+        for _, directory, _ in self.renditions:
+            os.makedirs(directory, exist_ok=True)
+        self.workers = workers or os.cpu_count() or 1
+        self.counter = counter if counter is not None else Value('i', 0)
+        self._pool = Pool(self.workers)
+        log.debug('Thumbnail engine started with %d workers and the %s preset',
+                  self.workers, preset)
+
+    def pending(self):
+        """ Number of jobs submitted and not finished yet """
+        return self.counter.value
+
+    def _add_pending(self, delta):
+        """ Update the number of jobs in flight """
+        with self.counter.get_lock():
+            self.counter.value += delta
+
+    def _apply(self, function, args, callback, error_callback):
+        """ Run function(*args) on the pool, counted until its callback
+        returned; return its AsyncResult """
+        def done(result):
+            try:
+                if callback is not None:
+                    callback(result)
+            finally:
+                self._add_pending(-1)
+
+        def failed(err):
+            try:
+                if error_callback is not None:
+                    error_callback(err)
+            finally:
+                self._add_pending(-1)
+        self._add_pending(1)
+        try:
+            return self._pool.apply_async(function, args, callback=done,
+                                          error_callback=failed)
+        except ValueError:
+            # the pool is closed
+            self._add_pending(-1)
+            raise
+
+    def submit(self, source, basename, callback):
+        """
+        Create the renditions of source (a path or the JPEG data) in the
+        background, callback is then
+        called with the dictionary {name: path of the rendition}
+        """
+        def error_callback(err):
+            log.error('Cannot create the renditions of %s: %s', basename, err)
+        self._apply(make_renditions,
+                    (source, basename, self.renditions, self.preset),
+                    callback, error_callback)
+
+    def submit_job(self, function, args, callback=None, error_callback=None):
+        """
+        Run function(*args) (a module-level function, e.g. a composite) on
+        the pool, callback is then called with its result; return the
+        multiprocessing AsyncResult of the job
+        """
+        return self._apply(function, args, callback, error_callback)
+
+    def close(self):
+        """ Wait for the pending pictures and stop the workers """
+        self._pool.close()
+        self._pool.join()